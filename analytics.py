@@ -0,0 +1,250 @@
+"""
+Pre-aggregated analytics for diagnosis accuracy
+Keeps per (condition, location, age band, week) and per (condition,
+location, hour) rollups up to date as submissions and feedback are
+committed, so stats and surveillance never scan submissions
+"""
+
+from collections import Counter
+from functools import partial
+from datetime import datetime, timedelta, date
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, select
+
+import archive
+from app import app, db
+from models import ConditionStat, Feedback, HourlyConditionStat, Submission, decode_diagnosis, insert_for_dialect
+
+UNKNOWN = "unknown"
+NO_DIAGNOSIS = "none"
+
+# (upper age bound exclusive, band label)
+AGE_BANDS = [
+    (5, "0-4"),
+    (15, "5-14"),
+    (25, "15-24"),
+    (45, "25-44"),
+    (65, "45-64"),
+]
+OLDEST_AGE_BAND = "65+"
+
+GROUP_BY_COLUMNS = {
+    "condition": ConditionStat.condition,
+    "location": ConditionStat.location,
+    "age_band": ConditionStat.age_band,
+    "week": ConditionStat.week_start,
+}
+
+RollupKey = Tuple[str, str, str, date]
+HourlyKey = Tuple[str, str, datetime]
+
+
+def age_band(age: Optional[int]) -> str:
+    if age is None:
+        return UNKNOWN
+    for upper, label in AGE_BANDS:
+        if age < upper:
+            return label
+    return OLDEST_AGE_BAND
+
+
+def week_start(created_at: Optional[datetime]) -> date:
+    """Monday of the week the timestamp falls in"""
+    day = (created_at or datetime.utcnow()).date()
+    return day - timedelta(days=day.weekday())
+
+
+def top_condition(diagnosis: Optional[Dict[str, Any]]) -> str:
+    diagnoses = (diagnosis or {}).get("diagnoses") or []
+    return diagnoses[0]["condition"] if diagnoses else NO_DIAGNOSIS
+
+
+def hour_start(created_at: Optional[datetime]) -> datetime:
+    return (created_at or datetime.utcnow()).replace(minute=0, second=0, microsecond=0)
+
+
+def rollup_key(submission) -> RollupKey:
+    """Rollup key of a Submission, or of a dict of submission column values"""
+    if isinstance(submission, dict):
+        get = submission.get
+        diagnosis = decode_diagnosis(get("kb_version"), get("diagnosis_data"))
+    else:
+        get = partial(getattr, submission)
+        diagnosis = submission.diagnosis
+    return (
+        top_condition(diagnosis),
+        get("location") or UNKNOWN,
+        age_band(get("age")),
+        week_start(get("created_at")),
+    )
+
+
+def _increment(key: RollupKey, submissions: int = 0, feedback: int = 0, accurate: int = 0):
+    """Add deltas to one rollup row, creating it if needed, in the current transaction"""
+    condition, location, band, week = key
+    insert = insert_for_dialect()
+    if insert is not None:
+        stmt = insert(ConditionStat).values(
+            condition=condition, location=location, age_band=band, week_start=week,
+            submissions=submissions, feedback=feedback, accurate=accurate,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["condition", "location", "age_band", "week_start"],
+            set_={
+                "submissions": ConditionStat.submissions + stmt.excluded.submissions,
+                "feedback": ConditionStat.feedback + stmt.excluded.feedback,
+                "accurate": ConditionStat.accurate + stmt.excluded.accurate,
+            },
+        )
+        db.session.execute(stmt)
+        return
+
+    stat = db.session.execute(
+        select(ConditionStat).filter_by(condition=condition, location=location,
+                                        age_band=band, week_start=week).with_for_update()
+    ).scalar_one_or_none()
+    if stat is None:
+        stat = ConditionStat(condition=condition, location=location, age_band=band, week_start=week,
+                             submissions=0, feedback=0, accurate=0)
+        db.session.add(stat)
+    stat.submissions += submissions
+    stat.feedback += feedback
+    stat.accurate += accurate
+
+
+def hourly_key(key: RollupKey, created_at: Optional[datetime]) -> HourlyKey:
+    """Hourly surveillance key for a submission with the given rollup key"""
+    condition, location, _, _ = key
+    return condition, location, hour_start(created_at)
+
+
+def _increment_hourly(key: HourlyKey, submissions: int):
+    condition, location, hour = key
+    insert = insert_for_dialect()
+    if insert is not None:
+        stmt = insert(HourlyConditionStat).values(condition=condition, location=location, hour=hour,
+                                                  submissions=submissions)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["hour", "location", "condition"],
+            set_={"submissions": HourlyConditionStat.submissions + stmt.excluded.submissions},
+        )
+        db.session.execute(stmt)
+        return
+
+    stat = db.session.execute(
+        select(HourlyConditionStat).filter_by(condition=condition, location=location, hour=hour).with_for_update()
+    ).scalar_one_or_none()
+    if stat is None:
+        stat = HourlyConditionStat(condition=condition, location=location, hour=hour, submissions=0)
+        db.session.add(stat)
+    stat.submissions += submissions
+
+
+def record_submissions(submissions: Iterable[Any]):
+    """Count new submissions in the rollups; call before committing them"""
+    counts = Counter()
+    hourly = Counter()
+    for submission in submissions:
+        key = rollup_key(submission)
+        counts[key] += 1
+        created_at = submission["created_at"] if isinstance(submission, dict) else submission.created_at
+        hourly[hourly_key(key, created_at)] += 1
+    for key, count in counts.items():
+        _increment(key, submissions=count)
+    for key, count in hourly.items():
+        _increment_hourly(key, count)
+
+
+def record_feedback(submission: Submission, is_accurate: bool, previous: Optional[bool] = None):
+    """Count new or changed feedback in the rollups; call before committing it.
+
+    previous is the earlier is_accurate value when feedback is being updated.
+    """
+    key = rollup_key(submission)
+    if previous is None:
+        _increment(key, feedback=1, accurate=int(is_accurate))
+    elif previous != is_accurate:
+        _increment(key, accurate=int(is_accurate) - int(previous))
+
+
+def rebuild_rollups(batch_size: int = 1000) -> int:
+    """Recompute every rollup from the submission table and the archive; returns the number of rollup rows"""
+    totals: Dict[RollupKey, List[int]] = {}
+    hourly: Dict[HourlyKey, int] = Counter()
+
+    def add(key: RollupKey, created_at: Optional[datetime], is_accurate: Optional[bool]):
+        hourly[hourly_key(key, created_at)] += 1
+        counts = totals.setdefault(key, [0, 0, 0])
+        counts[0] += 1
+        if is_accurate is not None:
+            counts[1] += 1
+            counts[2] += int(is_accurate)
+
+    rows = db.session.execute(
+        select(Submission, Feedback.is_accurate)
+        .outerjoin(Feedback, Feedback.submission_id == Submission.id)
+        .execution_options(yield_per=batch_size)
+    )
+    for submission, is_accurate in rows:
+        add(rollup_key(submission), submission.created_at, is_accurate)
+        db.session.expunge(submission)
+    for row in archive.iter_archived():
+        add(rollup_key(row._asdict()), row.created_at, row.is_accurate)
+
+    db.session.execute(delete(ConditionStat))
+    db.session.add_all(
+        ConditionStat(condition=condition, location=location, age_band=band, week_start=week,
+                      submissions=submissions, feedback=feedback, accurate=accurate)
+        for (condition, location, band, week), (submissions, feedback, accurate) in totals.items()
+    )
+    db.session.execute(delete(HourlyConditionStat))
+    db.session.add_all(
+        HourlyConditionStat(condition=condition, location=location, hour=hour, submissions=submissions)
+        for (condition, location, hour), submissions in hourly.items()
+    )
+    db.session.commit()
+    return len(totals)
+
+
+def get_stats(group_by: List[str], filters: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Sum the rollups grouped by the given dimensions.
+
+    filters may contain condition, location, age_band, since and until (dates
+    compared against the week start).
+    """
+    columns = [GROUP_BY_COLUMNS[name].label(name) for name in group_by]
+    query = select(
+        *columns,
+        func.sum(ConditionStat.submissions).label("submissions"),
+        func.sum(ConditionStat.feedback).label("feedback"),
+        func.sum(ConditionStat.accurate).label("accurate"),
+    )
+    for name in ("condition", "location", "age_band"):
+        if filters.get(name):
+            query = query.where(GROUP_BY_COLUMNS[name] == filters[name])
+    if filters.get("since"):
+        query = query.where(ConditionStat.week_start >= week_start(filters["since"]))
+    if filters.get("until"):
+        query = query.where(ConditionStat.week_start <= filters["until"].date())
+    if columns:
+        query = query.group_by(*columns).order_by(*columns)
+
+    stats = []
+    for row in db.session.execute(query).mappings():
+        stat = dict(row)
+        if "week" in stat:
+            stat["week"] = stat["week"].isoformat()
+        stat["submissions"] = stat["submissions"] or 0
+        stat["feedback"] = stat["feedback"] or 0
+        stat["accurate"] = stat["accurate"] or 0
+        stat["accuracy"] = round(stat["accurate"] / stat["feedback"] * 100, 1) if stat["feedback"] else None
+        stats.append(stat)
+    return stats
+
+
+@app.cli.command("rebuild-stats")
+def rebuild_stats_command():
+    """Recompute the analytics rollup tables from all submissions, archived ones included."""
+    count = rebuild_rollups()
+    print(f"Rebuilt {count} rollup rows")
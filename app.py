@@ -1,40 +1,114 @@
 import logging
 import os
+from contextlib import contextmanager
+from functools import wraps
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Delete, Insert, Update
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging; set LOG_LEVEL=DEBUG for verbose output
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+
+# Bind key of the read replica engine, configured by DATABASE_REPLICA_URL
+REPLICA = "replica"
+
+
+class RoutingSession(Session):
+    """Sends reads to the replica while the session is in replica mode (see use_replica).
+
+    Flushes, INSERT/UPDATE/DELETE and SELECT ... FOR UPDATE always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and self.info.get(REPLICA) and not self._flushing
+                and not isinstance(clause, (Insert, Update, Delete))
+                and getattr(clause, "_for_update_arg", None) is None):
+            engine = db.engines.get(REPLICA)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(model_class=Base, session_options={"class_": RoutingSession})
+
+
+def read_engine():
+    """Engine for reads that tolerate replica lag; the primary when no replica is configured"""
+    return db.engines.get(REPLICA, db.engine)
+
+
+@contextmanager
+def replica_reads():
+    """Run the session's reads on the replica inside this block"""
+    previous = db.session.info.get(REPLICA, False)
+    db.session.info[REPLICA] = True
+    try:
+        yield
+    finally:
+        db.session.info[REPLICA] = previous
+
+
+def reads_from_replica(view):
+    """Decorate a view whose queries can all be served by the replica"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def engine_options(url, statement_timeout_ms):
+    """Pool and timeout settings for one engine, from the DB_* environment variables.
+
+    pool_pre_ping costs a round trip per checkout, so it is off unless
+    DB_POOL_PRE_PING=1; recycling connections every DB_POOL_RECYCLE seconds
+    keeps them from going stale instead.
+    """
+    options = {
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", "300")),
+        "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "0") == "1",
+    }
+    if not url.startswith("sqlite"):
+        options["pool_size"] = int(os.environ.get("DB_POOL_SIZE", "5"))
+        options["max_overflow"] = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+        options["pool_timeout"] = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+    if url.startswith("postgres") and statement_timeout_ms:
+        options["connect_args"] = {"options": f"-c statement_timeout={int(statement_timeout_ms)}"}
+    return options
+
 
 # create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
-# configure the database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///medical_diagnostic.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+# configure the database; history, stats and exports read from DATABASE_REPLICA_URL when it is set
+database_url = os.environ.get("DATABASE_URL", "sqlite:///medical_diagnostic.db")
+app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_url, os.environ.get("DB_STATEMENT_TIMEOUT_MS"))
+replica_url = os.environ.get("DATABASE_REPLICA_URL")
+if replica_url:
+    app.config["SQLALCHEMY_BINDS"] = {REPLICA: {
+        "url": replica_url,
+        **engine_options(replica_url, os.environ.get("DB_REPLICA_STATEMENT_TIMEOUT_MS")),
+    }}
+
+# Retention: `flask --app main archive` moves submissions older than this into gzipped monthly files
+app.config["RETENTION_DAYS"] = int(os.environ.get("SUBMISSION_RETENTION_DAYS", "365"))
+app.config["ARCHIVE_DIR"] = os.environ.get("ARCHIVE_DIR") or os.path.join(app.instance_path, "archive")
 
 # initialize the app with the extension
+# Tables are created by the migration step (flask --app main migrate), not on import
 db.init_app(app)
 
-with app.app_context():
-    # Import models and routes
-
-    # Create all database tables
-    db.create_all()
-
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
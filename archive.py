@@ -0,0 +1,286 @@
+"""
+Retention of old submissions in compressed monthly archive files
+`flask --app main archive` moves submissions created before the retention
+period, with their feedback, into gzipped NDJSON files partitioned by the
+month they were created in, and deletes them from the database, so the
+live tables, their indexes and VACUUM only cover recent data. Rows keep
+their stored compact form and decode with the knowledge base versions kept
+in the database. Export and the rollup and likelihood rebuilds read the
+files back, skipping months outside the requested range; the rollups
+themselves are left alone, so stats keep counting archived submissions.
+"""
+
+import fcntl
+import gzip
+import heapq
+import json
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+
+import click
+from sqlalchemy import delete, func, select, text
+
+from app import app, db
+from models import Feedback, Submission
+
+# Submissions moved per transaction
+BATCH_SIZE = 1000
+
+# Ids per IN clause when checking an interrupted batch
+CHECK_CHUNK = 500
+
+# submissions-<year>-<month>-<first submission id>.ndjson.gz; each run starts its own file per month
+_FILE_RE = re.compile(r"^submissions-(\d{4})-(\d{2})-(\d+)\.ndjson\.gz$")
+
+# The batch being moved: its submission ids and each file's size before it was appended to
+JOURNAL = "archive.journal"
+LOCK = "archive.lock"
+
+
+class ArchivedRow(NamedTuple):
+    """An archived submission and its feedback, named like the columns export.iter_rows selects"""
+    id: int
+    created_at: datetime
+    name: Optional[str]
+    age: Optional[int]
+    gender: Optional[str]
+    location: Optional[str]
+    kb_version: Optional[str]
+    symptom_ids: List[Any]
+    symptoms_text: Optional[str]
+    diagnosis_data: Dict[str, Any]
+    client_id: Optional[str]
+    is_accurate: Optional[bool]
+    comments: Optional[str]
+    feedback_at: Optional[datetime]
+
+
+class ArchiveFile(NamedTuple):
+    path: str
+    month: datetime
+    first_id: int
+
+
+def archive_dir() -> str:
+    return app.config["ARCHIVE_DIR"]
+
+
+def month_start(moment: datetime) -> datetime:
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(month: datetime) -> datetime:
+    return month_start(month.replace(day=28) + timedelta(days=4))
+
+
+def archive_files(directory: Optional[str] = None, since: Optional[datetime] = None,
+                  until: Optional[datetime] = None) -> List[ArchiveFile]:
+    """Archive files whose month overlaps [since, until), by first submission id"""
+    directory = directory or archive_dir()
+    if not os.path.isdir(directory):
+        return []
+    files = []
+    for filename in os.listdir(directory):
+        match = _FILE_RE.match(filename)
+        if not match:
+            continue
+        month = datetime(int(match.group(1)), int(match.group(2)), 1)
+        if (since and next_month(month) <= since) or (until and month >= until):
+            continue
+        files.append(ArchiveFile(os.path.join(directory, filename), month, int(match.group(3))))
+    files.sort(key=lambda f: f.first_id)
+    return files
+
+
+def _encode(row: ArchivedRow) -> str:
+    values = row._asdict()
+    for name in ("created_at", "feedback_at"):
+        if values[name] is not None:
+            values[name] = values[name].isoformat()
+    return json.dumps(values) + "\n"
+
+
+def _decode(line: str) -> ArchivedRow:
+    values = json.loads(line)
+    for name in ("created_at", "feedback_at"):
+        if values[name] is not None:
+            values[name] = datetime.fromisoformat(values[name])
+    return ArchivedRow(**values)
+
+
+def read_file(path: str) -> Iterator[ArchivedRow]:
+    """Rows of one archive file, in submission id order"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield _decode(line)
+
+
+def _merge(files: List[ArchiveFile]) -> Iterator[ArchivedRow]:
+    """Merge files by submission id, opening each only once the merge reaches its first id"""
+    heap = []
+    opened = 0
+    while True:
+        while opened < len(files) and (not heap or files[opened].first_id <= heap[0][0]):
+            rows = read_file(files[opened].path)
+            row = next(rows, None)
+            if row is not None:
+                heapq.heappush(heap, (row.id, opened, row, rows))
+            opened += 1
+        if not heap:
+            return
+        _, position, row, rows = heapq.heappop(heap)
+        yield row
+        row = next(rows, None)
+        if row is not None:
+            heapq.heappush(heap, (row.id, position, row, rows))
+
+
+def iter_archived(filters: Optional[Dict[str, Any]] = None, after: int = 0,
+                  directory: Optional[str] = None) -> Iterator[ArchivedRow]:
+    """Archived rows in submission id order, starting after the given id.
+
+    filters may contain since (inclusive) and until (exclusive) datetimes and
+    location, as for export.iter_rows; only the months they cover are read.
+    """
+    filters = filters or {}
+    since, until, location = filters.get("since"), filters.get("until"), filters.get("location")
+    for row in _merge(archive_files(directory, since, until)):
+        if row.id <= after or (since and row.created_at < since) or (until and row.created_at >= until):
+            continue
+        if location and row.location != location:
+            continue
+        yield row
+
+
+def _fsync_json(path: str, value: Dict[str, Any]):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(value, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _restore_sizes(directory: str, sizes: Dict[str, int]):
+    """Cut the files back to their sizes from before an uncommitted batch"""
+    for filename, size in sizes.items():
+        path = os.path.join(directory, filename)
+        if not os.path.exists(path):
+            continue
+        if size:
+            os.truncate(path, size)
+        else:
+            os.remove(path)
+
+
+def _recover(directory: str):
+    """Finish a batch a crashed run left behind: keep it if its delete committed, otherwise undo the appends"""
+    journal_path = os.path.join(directory, JOURNAL)
+    if not os.path.exists(journal_path):
+        return
+    with open(journal_path, encoding="utf-8") as f:
+        journal = json.load(f)
+    ids = journal["ids"]
+    remaining = 0
+    for start in range(0, len(ids), CHECK_CHUNK):
+        remaining += db.session.scalar(
+            select(func.count(Submission.id)).where(Submission.id.in_(ids[start:start + CHECK_CHUNK])))
+    db.session.rollback()
+    if remaining:
+        _restore_sizes(directory, journal["sizes"])
+        app.logger.info(f"Rolled back an interrupted archive batch of {len(ids)} submissions")
+    os.remove(journal_path)
+
+
+def _append(directory: str, rows: List[ArchivedRow], files: Dict[datetime, str]):
+    """Append rows to this run's file for their month, journaling the files' previous sizes first"""
+    groups: Dict[str, List[ArchivedRow]] = {}
+    for row in rows:
+        month = month_start(row.created_at)
+        if month not in files:
+            files[month] = f"submissions-{month:%Y-%m}-{row.id}.ndjson.gz"
+        groups.setdefault(files[month], []).append(row)
+
+    sizes = {}
+    for filename in groups:
+        path = os.path.join(directory, filename)
+        sizes[filename] = os.path.getsize(path) if os.path.exists(path) else 0
+    _fsync_json(os.path.join(directory, JOURNAL), {"ids": [row.id for row in rows], "sizes": sizes})
+    for filename, group in groups.items():
+        # Each batch is a gzip member of its own; readers see one continuous stream
+        with open(os.path.join(directory, filename), "ab") as f:
+            f.write(gzip.compress("".join(_encode(row) for row in group).encode("utf-8"), mtime=0))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def archive_submissions(before: datetime, directory: Optional[str] = None, batch_size: int = BATCH_SIZE) -> int:
+    """Move submissions created before the given time into the archive; returns how many moved.
+
+    Each batch is appended to the files and journaled before its rows are
+    deleted in one transaction, so a crash at any point leaves every row in
+    exactly one place once the next run has recovered.
+    """
+    directory = directory or archive_dir()
+    os.makedirs(directory, exist_ok=True)
+    query = (
+        select(Submission.id, Submission.created_at, Submission.name, Submission.age,
+               Submission.gender, Submission.location, Submission.kb_version, Submission.symptom_ids,
+               Submission.symptoms_text, Submission.diagnosis_data, Submission.client_id,
+               Feedback.is_accurate, Feedback.comments, Feedback.created_at.label("feedback_at"))
+        .outerjoin(Feedback, Feedback.submission_id == Submission.id)
+        .where(Submission.created_at < before)
+        .order_by(Submission.id)
+        .limit(batch_size)
+        # Feedback arriving for a row being moved waits for the batch, then finds it gone
+        .with_for_update(of=Submission)
+    )
+    moved = 0
+    last_id = 0
+    files: Dict[datetime, str] = {}
+    with open(os.path.join(directory, LOCK), "w") as lock_file:
+        # One run at a time; a second waits here
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        _recover(directory)
+        while True:
+            try:
+                with db.engine.begin() as conn:
+                    rows = [ArchivedRow(**row._mapping) for row in conn.execute(query.where(Submission.id > last_id))]
+                    if not rows:
+                        break
+                    _append(directory, rows, files)
+                    ids = [row.id for row in rows]
+                    conn.execute(delete(Feedback).where(Feedback.submission_id.in_(ids)))
+                    conn.execute(delete(Submission).where(Submission.id.in_(ids)))
+            except Exception:
+                # The commit may have gone through before the error; recovery checks
+                _recover(directory)
+                raise
+            os.remove(os.path.join(directory, JOURNAL))
+            moved += len(rows)
+            last_id = rows[-1].id
+            if len(rows) < batch_size:
+                break
+    return moved
+
+
+def vacuum():
+    """Return the space archived rows used to the operating system and refresh planner statistics"""
+    statements = ["VACUUM"] if db.engine.dialect.name == "sqlite" else ["VACUUM ANALYZE submission",
+                                                                        "VACUUM ANALYZE feedback"]
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for statement in statements:
+            conn.execute(text(statement))
+
+
+@app.cli.command("archive")
+@click.option("--days", type=int, help="Archive submissions older than this many days "
+                                       "(default: SUBMISSION_RETENTION_DAYS, or 365).")
+@click.option("--vacuum", "reclaim", is_flag=True, help="VACUUM the database afterwards.")
+def archive_command(days, reclaim):
+    """Move old submissions and their feedback into compressed monthly archive files."""
+    days = app.config["RETENTION_DAYS"] if days is None else days
+    moved = archive_submissions(datetime.utcnow() - timedelta(days=days))
+    if reclaim:
+        vacuum()
+    print(f"Archived {moved} submissions to {archive_dir()}")
@@ -0,0 +1,273 @@
+"""
+Naive-Bayes scoring learned from diagnosis feedback
+Submissions whose feedback confirms the top diagnosis are counted per
+(condition, symptom). The counts become per-condition log-probability rows
+that DiagnosticEngine ranks with in place of the fixed symptom weights
+"""
+
+import heapq
+import math
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, select
+
+import archive
+from app import app, db
+from diagnostic_engine import OTHER_LIKELIHOOD, CompiledCondition, KnowledgeBase
+from models import Feedback, LikelihoodCount, Submission, decode_diagnosis, insert_for_dialect
+
+# symptom value of the row counting all confirmed submissions of a condition
+TOTAL = ""
+
+# The knowledge base's own symptom lists (CompiledCondition.likelihood) act as this
+# many pseudo-observations, so conditions without feedback still rank sensibly
+PRIOR_STRENGTH = 10.0
+
+# Pseudo-count every condition starts with for the class prior
+PRIOR_CONDITION_COUNT = 1.0
+
+# condition name -> {symptom code or TOTAL: count}
+Counts = Dict[str, Dict[str, int]]
+
+
+class _ConditionRow:
+    """Log-probability vector of one condition over the symptom bits"""
+    __slots__ = ("compiled", "base", "default_delta", "deltas")
+
+    def __init__(self, compiled, base: float, default_delta: float, deltas: Dict[int, float]):
+        self.compiled = compiled
+        # log P(c), up to a shared constant, plus the sum over all symptoms of log P(absent | c)
+        self.base = base
+        # log P(present | c) - log P(absent | c), for bits without an entry in deltas
+        self.default_delta = default_delta
+        self.deltas = deltas
+
+
+class LikelihoodModel:
+    """An immutable naive-Bayes model compiled against one knowledge base"""
+    __slots__ = ("kb", "rows")
+
+    def __init__(self, kb: KnowledgeBase, counts: Counts):
+        self.kb = kb
+        self.rows = tuple(
+            _compile_row(compiled, counts.get(compiled.data["name"], {}), kb.symptom_index)
+            for compiled in kb.compiled_conditions
+        )
+
+    def with_counts(self, condition: str, condition_counts: Dict[str, int]) -> "LikelihoodModel":
+        """A copy with one condition's row recompiled from new counts"""
+        model = LikelihoodModel.__new__(LikelihoodModel)
+        model.kb = self.kb
+        model.rows = tuple(
+            _compile_row(row.compiled, condition_counts, self.kb.symptom_index)
+            if row.compiled.data["name"] == condition else row
+            for row in self.rows
+        )
+        return model
+
+    def rank(self, user_mask: int, limit: int = 3) -> List[Tuple[float, CompiledCondition]]:
+        """Posterior probabilities (percent, rounded) of the most likely conditions.
+
+        As with the rules, only conditions sharing a symptom with the patient
+        are candidates; the posterior is still normalized over every condition.
+        Candidates are kept even if their probability rounds to zero, since
+        the engine only uses the order.
+        """
+        bits = []
+        mask = user_mask
+        while mask:
+            low = mask & -mask
+            bits.append(low.bit_length() - 1)
+            mask ^= low
+
+        scores = []
+        for row in self.rows:
+            deltas = row.deltas
+            default = row.default_delta
+            score = row.base
+            for bit in bits:
+                score += deltas.get(bit, default)
+            scores.append(score)
+
+        candidates = [i for i, row in enumerate(self.rows) if row.compiled.all_mask & user_mask]
+        if not candidates:
+            return []
+        top = max(scores)
+        weights = [math.exp(score - top) for score in scores]
+        total = sum(weights)
+        ranked = heapq.nlargest(limit, candidates, key=scores.__getitem__)
+        return [(round(weights[i] / total * 100, 1), self.rows[i].compiled) for i in ranked]
+
+
+def _likelihood(count: int, total: int, prior: float) -> float:
+    return (count + PRIOR_STRENGTH * prior) / (total + PRIOR_STRENGTH)
+
+
+def _compile_row(compiled: CompiledCondition, condition_counts: Dict[str, int],
+                 symptom_index: Dict[str, int]) -> _ConditionRow:
+    total = condition_counts.get(TOTAL, 0)
+    # Symptoms the knowledge base lists for the condition or that feedback has seen with it
+    special = {}
+    for code, bit in symptom_index.items():
+        if compiled.all_mask >> bit & 1 or condition_counts.get(code):
+            special[bit] = code
+
+    default_p = _likelihood(0, total, OTHER_LIKELIHOOD)
+    absent = (len(symptom_index) - len(special)) * math.log(1 - default_p)
+    deltas = {}
+    for bit, code in special.items():
+        p = _likelihood(condition_counts.get(code, 0), total, compiled.likelihood(bit))
+        deltas[bit] = math.log(p) - math.log(1 - p)
+        absent += math.log(1 - p)
+    # The class prior's normalizer is the same for every condition, so it cancels out in rank()
+    prior = math.log(total + PRIOR_CONDITION_COUNT)
+    return _ConditionRow(compiled, prior + absent, math.log(default_p) - math.log(1 - default_p), deltas)
+
+
+def _confirmed(diagnosis) -> Optional[Tuple[str, List[str]]]:
+    """(top condition, processed symptoms) of a diagnosis, or None if it named no condition"""
+    diagnoses = (diagnosis or {}).get("diagnoses") or []
+    if not diagnoses:
+        return None
+    return diagnoses[0]["condition"], list(diagnosis.get("processed_symptoms") or [])
+
+
+class NaiveBayesTrainer:
+    """Keeps likelihood counts in the database and, when active, a compiled model on the engine.
+
+    Counts are recorded whether or not the model is active, so a deployment
+    can switch scoring modes without retraining. Feedback updates this
+    worker's model straight away; counts written by other workers are picked
+    up every refresh_interval seconds.
+    """
+
+    def __init__(self, engine, active: bool = True, refresh_interval: float = 60.0):
+        self.engine = engine
+        self.active = active
+        self.refresh_interval = refresh_interval
+        self.model: Optional[LikelihoodModel] = None
+        self._counts: Counts = {}
+        self._lock = threading.Lock()
+        self._next_refresh = 0.0
+
+    def refresh_if_due(self) -> bool:
+        """Reload the counts and recompile the model if they changed or the knowledge base was swapped"""
+        if not self.active:
+            return False
+        kb = self.engine.kb
+        due = time.monotonic() >= self._next_refresh
+        if not due and self.model is not None and self.model.kb is kb:
+            return False
+        with self._lock:
+            changed = self.model is None or self.model.kb is not kb
+            if due:
+                self._next_refresh = time.monotonic() + self.refresh_interval
+                counts = load_counts()
+                if counts != self._counts:
+                    self._counts = counts
+                    changed = True
+            if not changed:
+                return False
+            model = self.model = LikelihoodModel(kb, self._counts)
+        self.engine.set_scoring_model(model)
+        return True
+
+    def record_feedback(self, submission: Submission, is_accurate: bool, previous: Optional[bool] = None):
+        """Count new or changed feedback; call before committing it.
+
+        Only feedback confirming the top diagnosis is a training example, so a
+        change from accurate to inaccurate takes one back out.
+        """
+        delta = int(is_accurate) - int(bool(previous))
+        confirmed = _confirmed(submission.diagnosis)
+        if not delta or confirmed is None:
+            return
+        condition, symptoms = confirmed
+        _increment(condition, symptoms, delta)
+        if not self.active:
+            return
+
+        # A rolled back commit leaves this worker off until the next refresh reloads the counts
+        with self._lock:
+            condition_counts = dict(self._counts.get(condition, {}))
+            for symptom in [TOTAL] + symptoms:
+                condition_counts[symptom] = condition_counts.get(symptom, 0) + delta
+            self._counts = dict(self._counts, **{condition: condition_counts})
+            if self.model is None:
+                return
+            model = self.model = self.model.with_counts(condition, condition_counts)
+        self.engine.set_scoring_model(model)
+
+
+def load_counts() -> Counts:
+    counts: Counts = {}
+    for condition, symptom, count in db.session.execute(
+            select(LikelihoodCount.condition, LikelihoodCount.symptom, LikelihoodCount.count)):
+        counts.setdefault(condition, {})[symptom] = count
+    return counts
+
+
+def _increment(condition: str, symptoms: Iterable[str], delta: int):
+    """Add delta to a condition's total and symptom counts in the current transaction"""
+    insert = insert_for_dialect()
+    for symptom in [TOTAL] + list(symptoms):
+        if insert is not None:
+            stmt = insert(LikelihoodCount).values(condition=condition, symptom=symptom, count=delta)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["condition", "symptom"],
+                set_={"count": LikelihoodCount.count + stmt.excluded.count},
+            )
+            db.session.execute(stmt)
+            continue
+        row = db.session.execute(
+            select(LikelihoodCount).filter_by(condition=condition, symptom=symptom).with_for_update()
+        ).scalar_one_or_none()
+        if row is None:
+            row = LikelihoodCount(condition=condition, symptom=symptom, count=0)
+            db.session.add(row)
+        row.count += delta
+
+
+def rebuild_counts(batch_size: int = 1000) -> int:
+    """Recount every confirmed diagnosis, archived ones included; returns the number of training examples"""
+    counts: Dict[Tuple[str, str], int] = Counter()
+    examples = 0
+
+    def add(diagnosis):
+        nonlocal examples
+        confirmed = _confirmed(diagnosis)
+        if confirmed is None:
+            return
+        condition, symptoms = confirmed
+        examples += 1
+        for symptom in [TOTAL] + symptoms:
+            counts[condition, symptom] += 1
+
+    rows = db.session.execute(
+        select(Submission)
+        .join(Feedback, Feedback.submission_id == Submission.id)
+        .where(Feedback.is_accurate.is_(True))
+        .execution_options(yield_per=batch_size)
+    )
+    for (submission,) in rows:
+        add(submission.diagnosis)
+        db.session.expunge(submission)
+    for row in archive.iter_archived():
+        if row.is_accurate:
+            add(decode_diagnosis(row.kb_version, row.diagnosis_data))
+
+    db.session.execute(delete(LikelihoodCount))
+    db.session.add_all(LikelihoodCount(condition=condition, symptom=symptom, count=count)
+                       for (condition, symptom), count in counts.items())
+    db.session.commit()
+    return examples
+
+
+@app.cli.command("rebuild-likelihoods")
+def rebuild_likelihoods_command():
+    """Recompute the naive-Bayes likelihood counts from all feedback, archived submissions included."""
+    examples = rebuild_counts()
+    print(f"Counted {examples} confirmed diagnoses")
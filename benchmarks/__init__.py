@@ -0,0 +1,12 @@
+"""
+Benchmarks for the diagnosis pipeline
+
+    python -m benchmarks.bench_engine   # micro-benchmarks of DiagnosticEngine
+    python -m benchmarks.bench_app      # load test of the Flask app
+    python -m benchmarks.bench_startup  # gunicorn cold start and memory per worker
+    python -m benchmarks.client_parity  # browser engine (node) agrees with DiagnosticEngine
+
+bench_engine and bench_app accept --save NAME to store a baseline under
+benchmarks/baselines/ and --compare NAME to report p50 changes against it;
+they exit non-zero when a case regresses by more than 10%.
+"""
@@ -0,0 +1,130 @@
+"""
+Shared timing, reporting and baseline helpers for the benchmarks
+"""
+
+import json
+import os
+import platform
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Sequence
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+# A case is reported as a regression when its p50 gets this much slower
+REGRESSION_THRESHOLD = 1.10
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def measure(fn: Callable[[Any], Any], inputs: Sequence[Any], iterations: int,
+            warmup: int = 10, concurrency: int = 1) -> Dict[str, float]:
+    """Time fn over inputs (cycled) and measure peak traced memory in a separate pass.
+
+    With concurrency above 1 the calls are spread over that many threads and
+    throughput is measured against wall-clock time.
+    """
+    for i in range(min(warmup, iterations)):
+        fn(inputs[i % len(inputs)])
+
+    perf_counter_ns = time.perf_counter_ns
+
+    def timed(i):
+        value = inputs[i % len(inputs)]
+        t0 = perf_counter_ns()
+        fn(value)
+        return perf_counter_ns() - t0
+
+    started = perf_counter_ns()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            timings = list(pool.map(timed, range(iterations)))
+    else:
+        timings = [timed(i) for i in range(iterations)]
+    elapsed = (perf_counter_ns() - started) / 1e9
+
+    # tracemalloc slows every allocation down, so it never overlaps the timed pass
+    sample = min(iterations, 100)
+    tracemalloc.start()
+    try:
+        for i in range(sample):
+            fn(inputs[i % len(inputs)])
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "calls": iterations,
+        "throughput": iterations / elapsed if elapsed else 0.0,
+        "mean_us": sum(timings) / len(timings) / 1000,
+        "p50_us": percentile(timings, 50) / 1000,
+        "p95_us": percentile(timings, 95) / 1000,
+        "p99_us": percentile(timings, 99) / 1000,
+        "peak_kib": peak / 1024,
+    }
+
+
+def print_results(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]] = None):
+    header = f"{'case':<48} {'ops/s':>10} {'p50 us':>10} {'p95 us':>10} {'p99 us':>10} {'peak KiB':>9}"
+    if baseline:
+        header += f" {'p50 vs base':>12}"
+    print(header)
+    print("-" * len(header))
+    for case, r in results.items():
+        line = (f"{case:<48} {r['throughput']:>10.0f} {r['p50_us']:>10.1f} {r['p95_us']:>10.1f}"
+                f" {r['p99_us']:>10.1f} {r['peak_kib']:>9.1f}")
+        if baseline:
+            base = baseline.get(case)
+            if base and base["p50_us"]:
+                ratio = r["p50_us"] / base["p50_us"]
+                flag = "  REGRESSION" if ratio > REGRESSION_THRESHOLD else ""
+                line += f" {ratio:>11.2f}x{flag}"
+            else:
+                line += f" {'new':>12}"
+        print(line)
+
+
+def baseline_path(name: str) -> str:
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def save_baseline(name: str, results: Dict[str, Dict[str, float]], params: Dict[str, Any]):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    with open(baseline_path(name), "w") as f:
+        json.dump({
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "params": params,
+            "results": results,
+        }, f, indent=2, sort_keys=True)
+    print(f"Saved baseline to {baseline_path(name)}")
+
+
+def load_baseline(name: str) -> Dict[str, Dict[str, float]]:
+    with open(baseline_path(name)) as f:
+        return json.load(f)["results"]
+
+
+def add_baseline_arguments(parser):
+    parser.add_argument("--save", metavar="NAME", help="save results as baseline NAME")
+    parser.add_argument("--compare", metavar="NAME", help="compare results against baseline NAME")
+
+
+def report(args, results: Dict[str, Dict[str, float]], params: Dict[str, Any]) -> List[str]:
+    """Print results, optionally against a baseline, and save them; returns regressed cases"""
+    baseline = load_baseline(args.compare) if args.compare else None
+    print_results(results, baseline)
+    if args.save:
+        save_baseline(args.save, results, params)
+    if not baseline:
+        return []
+    return [case for case, r in results.items()
+            if case in baseline and baseline[case]["p50_us"]
+            and r["p50_us"] / baseline[case]["p50_us"] > REGRESSION_THRESHOLD]
@@ -0,0 +1,211 @@
+"""
+Macro load generator driving the Flask app through its test client
+
+Seeds a SQLite database with synthetic submissions, then replays realistic
+form payloads against /diagnose, /history and /feedback/<id>.
+
+    python -m benchmarks.bench_app [--rows 1000000] [--db PATH] [--requests 500]
+                                   [--concurrency 1] [--save NAME] [--compare NAME]
+
+Seeding a million rows takes a while; pass --db to keep the database and
+reuse it on later runs.
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from benchmarks._common import add_baseline_arguments, measure, report
+
+LOCATIONS = ["Accra", "Kumasi", "Tamale", "Takoradi", "Cape Coast", "Sunyani", "Ho", "Koforidua",
+             "Bolgatanga", "Wa", None]
+GENDERS = ["male", "female", "other", None]
+NAMES = ["Ama", "Kofi", "Akosua", "Kwame", "Abena", "Yaw", "Efua", "Kojo", None]
+FREE_TEXT = [
+    "",
+    "hot body since yesterday and head pain",
+    "my child has been throwing up and has loose stool",
+    "feeling weak, dizziness when I stand up, looking pale",
+    "coughing at night with sore throat and runny nose",
+    "stomach pain after eating and feeling sick for three days, also night sweats",
+]
+SEED_CHUNK = 10000
+
+
+def form_payloads(engine, count: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """Form submissions like the ones index.html posts"""
+    rnd = random.Random(seed)
+    codes = [s["code"] for s in engine.get_all_symptoms()]
+    bundles = [b["symptoms"] for b in engine.get_example_symptom_bundles()]
+    payloads = []
+    for _ in range(count):
+        symptoms = rnd.choice(bundles) if rnd.random() < 0.5 else rnd.sample(codes, rnd.randint(1, 6))
+        payload = {
+            "symptoms": list(symptoms),
+            "symptoms_text": rnd.choice(FREE_TEXT),
+            "name": rnd.choice(NAMES) or "",
+            "age": str(rnd.randint(0, 90)) if rnd.random() < 0.8 else "",
+            "gender": rnd.choice(GENDERS) or "",
+            "location": rnd.choice(LOCATIONS) or "",
+        }
+        payloads.append(payload)
+    return payloads
+
+
+def seed_database(app, db, engine, rows: int):
+    """Insert synthetic submissions (with feedback on a fifth of them) until the table has rows rows"""
+    from sqlalchemy import func, insert, select
+
+    from models import Feedback, Submission, encode_submission
+    from persistence import IdAllocator
+    import analytics
+
+    with app.app_context():
+        existing = db.session.scalar(select(func.count(Submission.id)))
+        if existing >= rows:
+            return existing
+        print(f"Seeding {rows - existing} submissions...", file=sys.stderr)
+
+        rnd = random.Random(42)
+        templates = []
+        for payload in form_payloads(engine, 200, seed=7):
+            diagnosis = engine.diagnose(payload["symptoms"], payload["symptoms_text"])
+            templates.append((payload, encode_submission(engine.kb, payload["symptoms"], diagnosis)))
+        start = datetime.utcnow() - timedelta(days=365)
+        # Ids come from id_block like the app's own, so a reused database never hands them out twice
+        ids = IdAllocator(app, Submission)
+
+        started = time.perf_counter()
+        remaining = rows - existing
+        while remaining:
+            chunk = min(SEED_CHUNK, remaining)
+            submissions, feedback = [], []
+            for submission_id in ids.allocate_many(chunk):
+                payload, encoded = rnd.choice(templates)
+                submissions.append({
+                    "id": submission_id,
+                    "name": payload["name"] or None,
+                    "age": int(payload["age"]) if payload["age"] else None,
+                    "gender": payload["gender"] or None,
+                    "location": payload["location"] or None,
+                    "symptoms_text": payload["symptoms_text"] or None,
+                    "created_at": start + timedelta(seconds=rnd.randint(0, 365 * 86400)),
+                    **encoded,
+                })
+                if rnd.random() < 0.2:
+                    feedback.append({"submission_id": submission_id, "is_accurate": rnd.random() < 0.7,
+                                     "created_at": datetime.utcnow()})
+            db.session.execute(insert(Submission), submissions)
+            if feedback:
+                db.session.execute(insert(Feedback), feedback)
+            db.session.commit()
+            remaining -= chunk
+        analytics.rebuild_rollups()
+        print(f"Seeded in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        return rows
+
+
+def sample_submission_ids(app, db, rnd: random.Random, count: int) -> List[int]:
+    """Ids of stored submissions picked at random; ids are allocated in blocks, so the range has gaps"""
+    from sqlalchemy import func, select
+
+    from models import Submission
+
+    with app.app_context():
+        highest = db.session.scalar(select(func.max(Submission.id)))
+        first_at_or_after = select(Submission.id).order_by(Submission.id).limit(1)
+        return [db.session.scalar(first_at_or_after.where(Submission.id >= rnd.randint(1, highest)))
+                for _ in range(count)]
+
+
+def run(args) -> Dict[str, Dict[str, float]]:
+    # The app reads DATABASE_URL at import time
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="ghanadiag-bench-"), "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(db_path)}"
+    os.environ.setdefault("SUBMISSION_SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(db_path)), "spool"))
+
+    import logging
+    logging.disable(logging.INFO)
+
+    from app import app, db
+    import migrations
+    import routes
+    with app.app_context():
+        # Brings a database kept from an older run up to date too
+        migrations.upgrade()
+
+    engine = routes.diagnostic_engine
+    seed_database(app, db, engine, args.rows)
+
+    payloads = form_payloads(engine, 500, seed=1)
+    client = app.test_client()
+    rnd = random.Random(3)
+
+    def post_diagnose(payload):
+        response = client.post("/diagnose", data=payload)
+        assert response.status_code == 200, response.status_code
+
+    results = {}
+    results["POST /diagnose"] = measure(post_diagnose, payloads, args.requests,
+                                        concurrency=args.concurrency)
+    routes.submission_writer.flush(timeout=60)
+
+    # Walk a few pages deep, the way people scroll through history
+    cursors = [None]
+    page = client.get("/history").get_data(as_text=True)
+    for _ in range(5):
+        match = re.search(r'/history\?cursor=([^"&]+)', page)
+        if not match:
+            break
+        cursors.append(match.group(1))
+        page = client.get(f"/history?cursor={match.group(1)}").get_data(as_text=True)
+
+    def get_history(cursor):
+        response = client.get(f"/history?cursor={cursor}" if cursor else "/history")
+        assert response.status_code == 200, response.status_code
+
+    results["GET /history"] = measure(get_history, cursors, args.requests, concurrency=args.concurrency)
+
+    submission_ids = sample_submission_ids(app, db, rnd, 200)
+
+    def get_feedback(submission_id):
+        response = client.get(f"/feedback/{submission_id}")
+        assert response.status_code == 200, response.status_code
+
+    def post_feedback(submission_id):
+        response = client.post(f"/feedback/{submission_id}",
+                               data={"is_accurate": rnd.choice(["yes", "no"]), "comments": "benchmark"})
+        assert response.status_code == 302, response.status_code
+
+    results["GET /feedback/<id>"] = measure(get_feedback, submission_ids, args.requests,
+                                            concurrency=args.concurrency)
+    results["POST /feedback/<id>"] = measure(post_feedback, submission_ids, args.requests,
+                                             concurrency=args.concurrency)
+    routes.submission_writer.close()
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000,
+                        help="submissions to seed the database with (default: %(default)s)")
+    parser.add_argument("--db", help="SQLite file to seed or reuse (default: a temporary file)")
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=1, help="client threads (default: %(default)s)")
+    add_baseline_arguments(parser)
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    regressions = report(args, results, {"rows": args.rows, "requests": args.requests,
+                                         "concurrency": args.concurrency})
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
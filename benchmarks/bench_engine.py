@@ -0,0 +1,147 @@
+"""
+Micro-benchmarks for DiagnosticEngine over synthetic knowledge bases
+
+    python -m benchmarks.bench_engine [--conditions 5,50,500,5000] [--save NAME] [--compare NAME]
+"""
+
+import argparse
+import random
+import sys
+from typing import Any, Dict, List
+
+from diagnostic_engine import DiagnosticEngine, KnowledgeBase
+
+from benchmarks._common import add_baseline_arguments, measure, report
+
+TEXT_SIZES = [10, 100, 1000, 10000]
+FILLER_WORDS = ["i", "have", "had", "a", "the", "since", "yesterday", "and", "my", "child",
+                "very", "bad", "also", "some", "at", "night", "after", "eating", "with"]
+
+
+def synthetic_knowledge_base(condition_count: int, seed: int = 0, varied_sizes: bool = False) -> Dict[str, Any]:
+    """A knowledge base shaped like knowledge_base.json with the given number of conditions.
+
+    Conditions list 4 primary, 4 secondary and 3 severity symptoms, or with
+    varied_sizes random counts, which give a wider range of max scores.
+    """
+    rnd = random.Random(seed)
+    symptom_count = max(40, condition_count // 2)
+    symptoms = [f"symptom_{i}" for i in range(symptom_count)]
+    conditions = {}
+    for i in range(condition_count):
+        primary, secondary, severity = (
+            (rnd.randint(1, 8), rnd.randint(0, 8), rnd.randint(0, 4)) if varied_sizes else (4, 4, 3))
+        picked = rnd.sample(symptoms, primary + secondary + severity)
+        conditions[f"condition_{i}"] = {
+            "name": f"Condition {i}",
+            "description": f"Synthetic condition {i}",
+            "primary_symptoms": picked[:primary],
+            "secondary_symptoms": picked[primary:primary + secondary],
+            "severity_indicators": picked[primary + secondary:],
+            "recommendations": [f"Recommendation {j}" for j in range(5)],
+            "urgency": rnd.choice(["low", "medium", "high"]),
+        }
+    symptom_mappings = {
+        code: [code.replace("_", " "), f"phrase {i} alpha", f"phrase {i} beta gamma"]
+        for i, code in enumerate(symptoms)
+    }
+    return {
+        "version": f"synthetic-{condition_count}",
+        "conditions": conditions,
+        "symptom_mappings": symptom_mappings,
+        "symptom_display": {},
+        "example_bundles": [],
+    }
+
+
+def synthetic_text(size: int, kb: Dict[str, Any], rnd: random.Random) -> str:
+    """Free text of roughly size bytes, mixing filler words with symptom phrases"""
+    phrases = [p for variations in kb["symptom_mappings"].values() for p in variations]
+    words: List[str] = []
+    length = 0
+    while length < size:
+        word = rnd.choice(phrases) if rnd.random() < 0.1 else rnd.choice(FILLER_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:size]
+
+
+def misspell(word: str, rnd: random.Random) -> str:
+    """word with one character dropped, doubled or swapped with the next"""
+    if len(word) < 5:
+        return word
+    i = rnd.randrange(len(word) - 1)
+    return rnd.choice([word[:i] + word[i + 1:], word[:i] + word[i] + word[i:],
+                       word[:i] + word[i + 1] + word[i] + word[i + 2:]])
+
+
+def misspelled_text(size: int, kb: Dict[str, Any], rnd: random.Random) -> str:
+    """Like synthetic_text, with a typo in every long word of every symptom phrase"""
+    return " ".join(misspell(word, rnd) for word in synthetic_text(size, kb, rnd).split(" "))
+
+
+def run(condition_counts: List[int], iterations: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for condition_count in condition_counts:
+        data = synthetic_knowledge_base(condition_count)
+        engine = DiagnosticEngine(cache_size=0, reload_interval=0)
+        engine.load_knowledge_base(KnowledgeBase(data))
+        rnd = random.Random(1)
+        codes = sorted(engine.kb.symptom_index)
+        symptom_sets = [rnd.sample(codes, rnd.randint(1, 8)) for _ in range(200)]
+        conditions = list(data["conditions"].values())
+        # Scale iterations down for large catalogs so every case takes similar time
+        calls = max(50, iterations * 5 // max(5, condition_count))
+
+        for size in TEXT_SIZES:
+            texts = [synthetic_text(size, data, rnd) for _ in range(20)]
+            results[f"normalize_symptoms[{condition_count} cond, {size} B]"] = measure(
+                engine.normalize_symptoms, texts, max(50, iterations * 10 // size))
+            # One text per call, so most typos reach the trigram index rather than the memo
+            size_calls = max(50, iterations * 10 // size)
+            texts = [misspelled_text(size, data, rnd) for _ in range(size_calls + 10)]
+            results[f"normalize_symptoms typos[{condition_count} cond, {size} B]"] = measure(
+                engine.normalize_symptoms, texts, size_calls)
+
+        score_inputs = [(s, conditions[i % len(conditions)]) for i, s in enumerate(symptom_sets)]
+        results[f"calculate_condition_score[{condition_count} cond]"] = measure(
+            lambda args: engine.calculate_condition_score(*args), score_inputs, iterations)
+
+        results[f"diagnose[{condition_count} cond]"] = measure(
+            lambda symptoms: engine.diagnose(symptoms), symptom_sets, calls)
+
+        text_inputs = [(s, synthetic_text(100, data, rnd)) for s in symptom_sets[:50]]
+        results[f"diagnose+text[{condition_count} cond, 100 B]"] = measure(
+            lambda args: engine.diagnose(*args), text_inputs, calls)
+
+        absent_inputs = [(s, rnd.sample(codes, 2)) for s in symptom_sets]
+        results[f"next_questions[{condition_count} cond]"] = measure(
+            lambda args: engine.next_questions(args[0], absent_symptoms=args[1]), absent_inputs, calls)
+
+        cached = DiagnosticEngine(cache_size=1024, reload_interval=0)
+        cached.load_knowledge_base(KnowledgeBase(data))
+        results[f"diagnose cached[{condition_count} cond]"] = measure(
+            lambda symptoms: cached.diagnose(symptoms), symptom_sets[:20], iterations)
+
+        results[f"get_all_symptoms[{condition_count} cond]"] = measure(
+            lambda _: engine.get_all_symptoms(), [None], iterations)
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conditions", default="5,50,500,5000",
+                        help="comma-separated catalog sizes (default: %(default)s)")
+    parser.add_argument("--iterations", type=int, default=2000,
+                        help="calls per case at the smallest catalog size (default: %(default)s)")
+    add_baseline_arguments(parser)
+    args = parser.parse_args(argv)
+
+    condition_counts = [int(n) for n in args.conditions.split(",")]
+    results = run(condition_counts, args.iterations)
+    regressions = report(args, results, {"conditions": condition_counts, "iterations": args.iterations})
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
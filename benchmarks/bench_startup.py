@@ -0,0 +1,104 @@
+"""
+Cold start and per-worker memory of the gunicorn deployment, with and without preloading
+
+Starts gunicorn with gunicorn.conf.py, times how long it takes until every
+worker answers, and reads each worker's proportional (PSS) and private (USS)
+memory from /proc. Linux only.
+
+    python -m benchmarks.bench_startup [--workers 4] [--threads 4]
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def worker_pids(master_pid: int) -> List[int]:
+    with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def memory_kib(pid: int) -> Dict[str, int]:
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                values[key] = int(rest.split()[0])
+    return {"pss": values["Pss"], "uss": values["Private_Clean"] + values["Private_Dirty"], "rss": values["Rss"]}
+
+
+def run(preload: bool, workers: int, threads: int, requests: int) -> Dict[str, float]:
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix="ghanadiag-startup-")
+    env = dict(os.environ,
+               PORT=str(port), WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(threads),
+               GUNICORN_PRELOAD="1" if preload else "0", METRICS_ENABLED="0",
+               DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+               SUBMISSION_SPOOL_DIR=os.path.join(workdir, "spool"))
+    started = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT, "gunicorn.conf.py"),
+                               "main:app"], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # Ready once every worker is forked and the app answers
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError("gunicorn exited during startup")
+            try:
+                if len(worker_pids(server.pid)) == workers:
+                    urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1).read()
+                    break
+            except OSError:
+                pass
+            time.sleep(0.01)
+        ready = time.perf_counter() - started
+
+        # Touch every worker a little so the numbers reflect a serving process
+        for _ in range(requests):
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5).read()
+        usage = [memory_kib(pid) for pid in worker_pids(server.pid)]
+    finally:
+        server.terminate()
+        server.wait(30)
+    return {
+        "ready_s": ready,
+        "pss_kib": sum(u["pss"] for u in usage) / len(usage),
+        "uss_kib": sum(u["uss"] for u in usage) / len(usage),
+        "rss_kib": sum(u["rss"] for u in usage) / len(usage),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="worker processes (default: %(default)s)")
+    parser.add_argument("--threads", type=int, default=4, help="threads per worker (default: %(default)s)")
+    parser.add_argument("--requests", type=int, default=50, help="warm-up requests (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    header = f"{'mode':<12} {'ready s':>8} {'PSS KiB/worker':>15} {'USS KiB/worker':>15} {'RSS KiB/worker':>15}"
+    print(header)
+    print("-" * len(header))
+    for preload in (False, True):
+        r = run(preload, args.workers, args.threads, args.requests)
+        print(f"{'preload' if preload else 'no preload':<12} {r['ready_s']:>8.2f} {r['pss_kib']:>15.0f}"
+              f" {r['uss_kib']:>15.0f} {r['rss_kib']:>15.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""
+Check that the browser's local diagnosis matches DiagnosticEngine.diagnose
+
+Runs static/js/diagnosis.js under Node.js against the /api/knowledge-base
+export and compares its results with the engine's rule-based scoring on
+random symptom selections and free text, misspellings included. The shipped
+knowledge base is checked, then synthetic catalogs whose varied symptom
+counts cover many more confidence values, exact rounding ties included.
+Exits non-zero on any mismatch.
+
+    python -m benchmarks.client_parity [--cases 2000] [--seed 0] [--synthetic 50,500]
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+from typing import Any, Dict, List
+
+from diagnostic_engine import DiagnosticEngine, KnowledgeBase
+
+from benchmarks.bench_engine import FILLER_WORDS, misspell, synthetic_knowledge_base
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "static", "js", "diagnosis.js")
+
+# Reads {"knowledge_base": ..., "cases": [[symptoms, text], ...]} on stdin and prints the results
+NODE_RUNNER = """
+const { LocalDiagnosticEngine } = require(process.argv[1]);
+let input = '';
+process.stdin.on('data', chunk => { input += chunk; });
+process.stdin.on('end', () => {
+    const { knowledge_base, cases } = JSON.parse(input);
+    const engine = new LocalDiagnosticEngine(knowledge_base);
+    process.stdout.write(JSON.stringify(cases.map(([symptoms, text]) => engine.diagnose(symptoms, text))));
+});
+"""
+
+EXTRA_WORDS = ["ɛyɛ", "mehyehyɛ", "ɔyare", "Fever!", "HEAD-pain", "stomach_pain", "2", "naïve"]
+
+
+def random_cases(engine: DiagnosticEngine, count: int, seed: int) -> List[List[Any]]:
+    rnd = random.Random(seed)
+    codes = sorted(engine.kb.symptom_index) + ["not_a_symptom"]
+    phrases = [p for variations in engine.symptom_mappings.values() for p in variations]
+    cases = []
+    for _ in range(count):
+        symptoms = rnd.sample(codes, rnd.randint(0, 6))
+        words = []
+        for _ in range(rnd.randint(0, 12)):
+            roll = rnd.random()
+            if roll < 0.3:
+                words.append(rnd.choice(phrases).upper() if rnd.random() < 0.2 else rnd.choice(phrases))
+            elif roll < 0.45:
+                # Typos for the fuzzy matcher, which both sides must correct the same way
+                words.append(" ".join(misspell(word, rnd) for word in rnd.choice(phrases).split()))
+            elif roll < 0.55:
+                words.append(rnd.choice(EXTRA_WORDS))
+            else:
+                words.append(rnd.choice(FILLER_WORDS))
+        cases.append([symptoms, rnd.choice([" ", ", ", "; "]).join(words)])
+    return cases
+
+
+def canonical(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Drop orderings that come from set iteration on the server, and the server-only follow-up questions"""
+    result = dict(result)
+    result.pop("next_questions", None)
+    if "processed_symptoms" in result:
+        result["processed_symptoms"] = sorted(result["processed_symptoms"])
+    result["diagnoses"] = [dict(d, matched_symptoms=sorted(d["matched_symptoms"])) for d in result["diagnoses"]]
+    return result
+
+
+def compare(engine: DiagnosticEngine, label: str, case_count: int, seed: int) -> int:
+    """Run random cases through both engines; returns the number of mismatches"""
+    cases = random_cases(engine, case_count, seed)
+    payload = json.dumps({"knowledge_base": engine.kb.client_export(), "cases": cases})
+    completed = subprocess.run(["node", "-e", NODE_RUNNER, SCRIPT], input=payload, capture_output=True,
+                               text=True, check=True)
+    local_results = json.loads(completed.stdout)
+
+    mismatches = 0
+    for (symptoms, text), local in zip(cases, local_results):
+        expected = canonical(engine.diagnose(symptoms, text))
+        if canonical(local) != expected:
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"Mismatch in {label} for symptoms={symptoms!r} text={text!r}")
+                print(f"  server: {json.dumps(expected, sort_keys=True)}")
+                print(f"  client: {json.dumps(canonical(local), sort_keys=True)}")
+    print(f"{label}: {len(cases) - mismatches}/{len(cases)} cases match")
+    return mismatches
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", type=int, default=2000, help="random cases per catalog (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: %(default)s)")
+    parser.add_argument("--knowledge-base", help="knowledge base file (default: knowledge_base.json)")
+    parser.add_argument("--synthetic", default="50,500",
+                        help="comma-separated sizes of synthetic catalogs to check too, or empty for none "
+                             "(default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    engine = DiagnosticEngine(knowledge_base_path=args.knowledge_base, cache_size=0, reload_interval=0)
+    mismatches = compare(engine, args.knowledge_base or "knowledge_base.json", args.cases, args.seed)
+    for condition_count in [int(n) for n in args.synthetic.split(",") if n]:
+        engine.load_knowledge_base(KnowledgeBase(
+            synthetic_knowledge_base(condition_count, seed=args.seed, varied_sizes=True)))
+        mismatches += compare(engine, f"synthetic {condition_count} conditions", args.cases, args.seed)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
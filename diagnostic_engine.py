@@ -3,147 +3,522 @@ Medical Diagnostic Engine for Ghana
 Implements rule-based diagnosis for common conditions in Ghana
 """
 
+import hashlib
+import heapq
 import json
-from typing import List, Dict, Any
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 
-class DiagnosticEngine:
-    def __init__(self):
-        self.conditions = {
-            "malaria": {
-                "name": "Malaria",
-                "description": "A mosquito-borne infectious disease common in Ghana",
-                "primary_symptoms": ["fever", "chills", "headache", "sweating"],
-                "secondary_symptoms": ["nausea", "vomiting", "fatigue", "body_aches"],
-                "severity_indicators": ["high_fever", "severe_headache", "confusion"],
-                "recommendations": [
-                    "Seek immediate medical attention for proper testing",
-                    "Get a malaria rapid diagnostic test (RDT) or blood test",
-                    "Take prescribed antimalarial medication if confirmed",
-                    "Use mosquito nets and repellents for prevention",
-                    "Stay hydrated and get plenty of rest"
-                ],
-                "urgency": "high"
-            },
-            "typhoid": {
-                "name": "Typhoid Fever", 
-                "description": "A bacterial infection spread through contaminated food and water",
-                "primary_symptoms": ["prolonged_fever", "abdominal_pain", "diarrhea", "constipation"],
-                "secondary_symptoms": ["headache", "weakness", "rose_spots", "enlarged_spleen"],
-                "severity_indicators": ["high_fever", "severe_abdominal_pain", "bloody_stool"],
-                "recommendations": [
-                    "Visit a healthcare facility for blood tests",
-                    "Complete full course of antibiotics if prescribed",
-                    "Drink clean, boiled water only",
-                    "Eat well-cooked, hot foods",
-                    "Practice good hand hygiene"
-                ],
-                "urgency": "high"
-            },
-            "flu": {
-                "name": "Influenza (Flu)",
-                "description": "A viral respiratory infection",
-                "primary_symptoms": ["fever", "cough", "sore_throat", "runny_nose"],
-                "secondary_symptoms": ["body_aches", "fatigue", "headache", "chills"],
-                "severity_indicators": ["difficulty_breathing", "chest_pain", "persistent_vomiting"],
-                "recommendations": [
-                    "Get plenty of rest and sleep",
-                    "Drink lots of fluids",
-                    "Take paracetamol for fever and aches",
-                    "Stay home to avoid spreading to others",
-                    "See a doctor if symptoms worsen or persist"
-                ],
-                "urgency": "medium"
-            },
-            "common_cold": {
-                "name": "Common Cold",
-                "description": "A mild viral infection of the nose and throat",
-                "primary_symptoms": ["runny_nose", "sneezing", "mild_cough", "sore_throat"],
-                "secondary_symptoms": ["mild_headache", "low_fever", "congestion"],
-                "severity_indicators": ["high_fever", "severe_headache", "difficulty_breathing"],
-                "recommendations": [
-                    "Rest and drink plenty of fluids",
-                    "Use warm salt water to gargle for sore throat",
-                    "Take paracetamol for mild aches",
-                    "Use steam inhalation for congestion",
-                    "Symptoms usually resolve in 7-10 days"
-                ],
-                "urgency": "low"
-            },
-            "anemia": {
-                "name": "Anemia",
-                "description": "A condition where you lack healthy red blood cells",
-                "primary_symptoms": ["fatigue", "weakness", "pale_skin", "shortness_of_breath"],
-                "secondary_symptoms": ["dizziness", "cold_hands", "brittle_nails", "fast_heartbeat"],
-                "severity_indicators": ["severe_fatigue", "chest_pain", "irregular_heartbeat"],
-                "recommendations": [
-                    "See a doctor for blood tests to confirm",
-                    "Eat iron-rich foods like beans, leafy greens, and meat",
-                    "Take iron supplements if prescribed",
-                    "Treat underlying causes like heavy periods",
-                    "Follow up regularly with healthcare provider"
-                ],
-                "urgency": "medium"
-            }
+from fuzzy import MAX_EDIT_DISTANCE, MIN_SIMILARITY, MIN_WORD_LENGTH, FuzzyMatcher
+
+# Urgency levels, in the order their codes are stored
+URGENCY_LEVELS = ("low", "medium", "high", "urgent")
+
+# Versioned condition catalog, symptom synonyms and display names
+DEFAULT_KNOWLEDGE_BASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge_base.json")
+
+# Weighted scoring
+PRIMARY_WEIGHT = 3
+SECONDARY_WEIGHT = 1
+SEVERITY_WEIGHT = 2
+
+# Chance a patient with the condition reports each kind of its symptoms, or any other symptom;
+# follow-up questions are chosen with these, and bayes.py starts its learned likelihoods from them
+PRIMARY_LIKELIHOOD = 0.8
+SECONDARY_LIKELIHOOD = 0.4
+SEVERITY_LIKELIHOOD = 0.3
+OTHER_LIKELIHOOD = 0.02
+
+# Follow-up questions returned with a diagnosis; gains below the minimum (in bits) aren't worth asking
+NEXT_QUESTIONS = 3
+MIN_INFORMATION_GAIN = 0.001
+
+# Words in free text; unicode-aware so Twi and Ga letters such as ɛ and ɔ count
+_WORD_RE = re.compile(r"[^\W_]+")
+
+
+def _tokenize(text: str) -> List[str]:
+    return _WORD_RE.findall(text.lower())
+
+
+def _binary_entropy(p: float) -> float:
+    """Entropy in bits of a yes/no answer that is yes with probability p"""
+    if p <= 0 or p >= 1:
+        return 0.0
+    return -p * math.log2(p) - (1 - p) * math.log2(1 - p)
+
+
+def _bits(mask: int) -> List[int]:
+    """Positions of the set bits of mask, lowest first"""
+    bits = []
+    while mask:
+        low = mask & -mask
+        bits.append(low.bit_length() - 1)
+        mask ^= low
+    return bits
+
+
+# Answer entropy of a symptom the condition doesn't list
+_OTHER_ENTROPY = _binary_entropy(OTHER_LIKELIHOOD)
+
+
+class CompiledCondition:
+    """A condition reduced to symptom bitmasks for fast scoring"""
+    __slots__ = ("key", "data", "primary_mask", "secondary_mask", "severity_mask",
+                 "all_mask", "max_possible", "answers")
+
+    def __init__(self, key: str, data: Dict[str, Any], symptom_index: Dict[str, int]):
+        self.key = key
+        self.data = data
+        self.primary_mask = _symptom_mask(data["primary_symptoms"], symptom_index, grow=True)
+        self.secondary_mask = _symptom_mask(data["secondary_symptoms"], symptom_index, grow=True)
+        self.severity_mask = _symptom_mask(data["severity_indicators"], symptom_index, grow=True)
+        self.all_mask = self.primary_mask | self.secondary_mask | self.severity_mask
+        self.max_possible = (len(data["primary_symptoms"]) * PRIMARY_WEIGHT +
+                             len(data["secondary_symptoms"]) * SECONDARY_WEIGHT +
+                             len(data["severity_indicators"]) * SEVERITY_WEIGHT)
+        # (bit, likelihood, answer entropy) of each listed symptom, less those of an unlisted one,
+        # for choosing follow-up questions
+        self.answers = tuple((bit, self.likelihood(bit) - OTHER_LIKELIHOOD,
+                              _binary_entropy(self.likelihood(bit)) - _OTHER_ENTROPY)
+                             for bit in _bits(self.all_mask))
+
+    def likelihood(self, bit: int) -> float:
+        """Prior chance that a patient with this condition reports the symptom"""
+        if self.primary_mask >> bit & 1:
+            return PRIMARY_LIKELIHOOD
+        if self.severity_mask >> bit & 1:
+            return SEVERITY_LIKELIHOOD
+        if self.secondary_mask >> bit & 1:
+            return SECONDARY_LIKELIHOOD
+        return OTHER_LIKELIHOOD
+
+    def confidence(self, user_mask: int) -> float:
+        """Rounded match confidence for a user symptom bitmask"""
+        if self.max_possible <= 0:
+            return 0
+        total_score = ((user_mask & self.primary_mask).bit_count() * PRIMARY_WEIGHT +
+                       (user_mask & self.secondary_mask).bit_count() * SECONDARY_WEIGHT +
+                       (user_mask & self.severity_mask).bit_count() * SEVERITY_WEIGHT)
+        return round((total_score / self.max_possible) * 100, 1)
+
+
+def _symptom_mask(symptoms: Iterable[str], symptom_index: Dict[str, int], grow: bool = False) -> int:
+    """Fold symptom codes into a bitmask, optionally assigning bits to unseen codes"""
+    mask = 0
+    for symptom in symptoms:
+        bit = symptom_index.get(symptom)
+        if bit is None:
+            if not grow:
+                continue
+            bit = symptom_index[symptom] = len(symptom_index)
+        mask |= 1 << bit
+    return mask
+
+
+class KnowledgeBase:
+    """An immutable, compiled snapshot of one knowledge base version.
+
+    Everything derived from the catalog (symptom bit index, condition masks
+    and answer tables, phrase trie, fuzzy word index, sorted symptom list) is
+    built once here, so swapping the engine's knowledge base is a single
+    attribute assignment.
+    """
+    __slots__ = ("data", "version", "storage_key", "conditions", "symptom_mappings", "symptom_display",
+                 "example_bundles", "bundles_by_slug", "symptom_index", "symptom_codes", "compiled_conditions",
+                 "condition_positions", "phrase_trie", "fuzzy_matcher", "symptoms", "display_names")
+
+    def __init__(self, data: Dict[str, Any]):
+        self.data = data
+        self.version = str(data.get("version", ""))
+        # Stored rows reference this; the content hash guards against edits without a version bump
+        content_hash = hashlib.sha1(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+        self.storage_key = f"{self.version}+{content_hash[:10]}"
+        self.conditions = data["conditions"]
+        self.symptom_mappings = data.get("symptom_mappings", {})
+        self.symptom_display = data.get("symptom_display", {})
+        self.example_bundles = data.get("example_bundles", [])
+        self.bundles_by_slug = {bundle_slug(bundle["name"]): bundle for bundle in self.example_bundles}
+
+        # Assign each symptom code a bit and reduce every condition to bitmasks
+        self.symptom_index: Dict[str, int] = {}
+        self.compiled_conditions = tuple(
+            CompiledCondition(key, condition, self.symptom_index)
+            for key, condition in self.conditions.items()
+        )
+        self.symptom_codes = tuple(sorted(self.symptom_index, key=self.symptom_index.get))
+        self.condition_positions = {condition["name"]: i for i, condition in enumerate(self.conditions.values())}
+        self.phrase_trie = _build_phrase_trie(self.symptom_mappings)
+        self.fuzzy_matcher = FuzzyMatcher(
+            word for variations in self.symptom_mappings.values() for variation in variations
+            for word in _tokenize(variation)
+        )
+        self.symptoms = tuple(
+            {"code": code, "display": self.symptom_display.get(code, code.replace("_", " ").title())}
+            for code in sorted(self.symptom_index)
+        )
+        self.display_names = {symptom["code"]: symptom["display"] for symptom in self.symptoms}
+
+    @classmethod
+    def load(cls, path: str) -> "KnowledgeBase":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def encode_symptoms(self, codes: Iterable[str]) -> List[Any]:
+        """Symptom codes as their integer IDs; codes outside the catalog stay strings"""
+        index = self.symptom_index
+        return [index.get(code, code) for code in codes]
+
+    def decode_symptoms(self, ids: Iterable[Any]) -> List[str]:
+        codes = self.symptom_codes
+        return [codes[i] if isinstance(i, int) else i for i in ids]
+
+    def encode_diagnosis(self, result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Reduce a diagnose() result to symptom IDs and per-condition tuples.
+
+        Returns None if the result names a condition this version doesn't have.
+        Descriptions, recommendations, matched symptoms and the message are all
+        rebuilt from the catalog by decode_diagnosis.
+        """
+        diagnoses = []
+        for d in result["diagnoses"]:
+            position = self.condition_positions.get(d["condition"])
+            if position is None:
+                return None
+            diagnoses.append([position, d["confidence"], URGENCY_LEVELS.index(d["urgency"]),
+                              d["primary_matches"], d["secondary_matches"], d["severity_matches"]])
+        return {"p": self.encode_symptoms(result.get("processed_symptoms", [])), "d": diagnoses}
+
+    def decode_diagnosis(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        if not data["p"]:
+            return _empty_result()
+        processed_symptoms = self.decode_symptoms(data["p"])
+        index = self.symptom_index
+        top_conditions = []
+        for position, confidence, urgency, primary_matches, secondary_matches, severity_matches in data["d"]:
+            compiled = self.compiled_conditions[position]
+            condition = compiled.data
+            all_mask = compiled.all_mask
+            top_conditions.append({
+                "condition": condition["name"],
+                "description": condition["description"],
+                "confidence": confidence,
+                "primary_matches": primary_matches,
+                "secondary_matches": secondary_matches,
+                "severity_matches": severity_matches,
+                "recommendations": condition["recommendations"],
+                "urgency": URGENCY_LEVELS[urgency],
+                "matched_symptoms": [s for s in processed_symptoms if s in index and all_mask >> index[s] & 1]
+            })
+        return _diagnosis_result(top_conditions, processed_symptoms)
+
+    def next_questions(self, user_mask: int, ranked: List[Tuple[float, CompiledCondition]],
+                       limit: int = NEXT_QUESTIONS, absent_mask: int = 0) -> List[Dict[str, Any]]:
+        """Symptoms not yet asked about that best tell the ranked conditions apart.
+
+        ranked is (confidence, compiled condition) pairs, most confident first.
+        The confidences, reweighted by the symptoms in absent_mask the patient
+        said they don't have, become a distribution over the candidates. Each
+        question's expected information gain is the mutual information between
+        its answer and the condition, h(P(yes)) - sum of P(c) h(P(yes | c)),
+        so a suggestion only walks the candidates' precomputed answer tables.
+        Symptoms no candidate lists gain nothing and are never looked at.
+        """
+        if len(ranked) < 2 or limit <= 0:
+            return []
+        weights = []
+        for confidence, compiled in ranked:
+            weight = confidence
+            for bit in _bits(absent_mask & compiled.all_mask):
+                weight *= 1 - compiled.likelihood(bit)
+            weights.append(weight)
+        total = sum(weights)
+        if total <= 0:
+            return []
+
+        # Start every symptom at the unlisted values and add each candidate's share of the difference
+        p_yes: Dict[int, float] = {}
+        conditional: Dict[int, float] = {}
+        for weight, (_, compiled) in zip(weights, ranked):
+            prior = weight / total
+            for bit, p, entropy in compiled.answers:
+                p_yes[bit] = p_yes.get(bit, OTHER_LIKELIHOOD) + prior * p
+                conditional[bit] = conditional.get(bit, _OTHER_ENTROPY) + prior * entropy
+
+        asked = user_mask | absent_mask
+        log2 = math.log2
+        gains = []
+        for bit, p in p_yes.items():
+            if asked >> bit & 1 or p >= 1:
+                continue
+            gain = -p * log2(p) - (1 - p) * log2(1 - p) - conditional[bit]
+            if gain >= MIN_INFORMATION_GAIN:
+                gains.append((-gain, bit))
+
+        codes = self.symptom_codes
+        # Equal gains go in symptom bit order
+        return [{"symptom": codes[bit], "display": self.display_names[codes[bit]],
+                 "information_gain": round(-gain, 3)}
+                for gain, bit in heapq.nsmallest(limit, gains)]
+
+    def client_export(self, fuzzy_matching: bool = True, scoring_mode: str = "rules") -> Dict[str, Any]:
+        """Compact form of the compiled catalog for scoring in the browser (static/js/diagnosis.js).
+
+        Condition symptoms are indexes into "symptoms"; phrases are already
+        tokenized so the client only has to tokenize the user's text. The
+        client builds its own fuzzy word index from the phrases. The browser
+        only scores with the fixed weights, so it leaves diagnosis to the
+        server while online unless scoring_mode is "rules".
+        """
+        phrases = []
+        for code, variations in self.symptom_mappings.items():
+            for variation in variations:
+                words = _tokenize(variation)
+                if words:
+                    phrases.append([words, code])
+        return {
+            "version": self.storage_key,
+            "scoring_mode": scoring_mode,
+            "weights": [PRIMARY_WEIGHT, SECONDARY_WEIGHT, SEVERITY_WEIGHT],
+            "symptoms": list(self.symptom_codes),
+            "conditions": [
+                {
+                    "name": compiled.data["name"],
+                    "description": compiled.data["description"],
+                    "recommendations": compiled.data["recommendations"],
+                    "urgency": compiled.data["urgency"],
+                    "primary": _bits(compiled.primary_mask),
+                    "secondary": _bits(compiled.secondary_mask),
+                    "severity": _bits(compiled.severity_mask),
+                    "max_possible": compiled.max_possible,
+                }
+                for compiled in self.compiled_conditions
+            ],
+            "phrases": phrases,
+            "fuzzy": {
+                "min_word_length": MIN_WORD_LENGTH,
+                "max_edit_distance": MAX_EDIT_DISTANCE,
+                "min_similarity": MIN_SIMILARITY,
+            } if fuzzy_matching else None,
         }
+
+
+def bundle_slug(name: str) -> str:
+    """URL slug of an example bundle name, as used by /api/example-symptoms/<slug>"""
+    return name.lower().replace(" ", "-")
+
+
+def _build_phrase_trie(symptom_mappings: Dict[str, List[str]]) -> Dict[Any, Any]:
+    """Build a word-level trie of every symptom variation.
+
+    Each node maps a word to its child node; the None key holds the symptom
+    codes of the phrases ending at that node.
+    """
+    trie: Dict[Any, Any] = {}
+    for standard_symptom, variations in symptom_mappings.items():
+        for variation in variations:
+            words = _tokenize(variation)
+            if not words:
+                continue
+            node = trie
+            for word in words:
+                node = node.setdefault(word, {})
+            node.setdefault(None, set()).add(standard_symptom)
+    return trie
+
+
+def _empty_result() -> Dict[str, Any]:
+    return {
+        "diagnoses": [],
+        "message": "No symptoms provided. Please select symptoms or describe how you feel.",
+        "total_symptoms": 0,
+        "next_questions": []
+    }
+
+
+def _diagnosis_result(top_conditions: List[Dict[str, Any]], all_symptoms: List[str]) -> Dict[str, Any]:
+    """Wrap scored conditions with the summary message"""
+    # Generate summary message
+    if not top_conditions:
+        message = "Based on your symptoms, we cannot match them to common conditions in our database. Please consult a healthcare professional for proper evaluation."
+    elif top_conditions[0]["confidence"] > 70:
+        message = f"Your symptoms strongly suggest {top_conditions[0]['condition']}. Please seek medical attention for proper diagnosis and treatment."
+    elif top_conditions[0]["confidence"] > 40:
+        message = f"Your symptoms may indicate {top_conditions[0]['condition']} or similar conditions. Medical evaluation is recommended."
+    else:
+        message = "Your symptoms match several possible conditions. A healthcare professional can provide proper diagnosis."
         
-        # Symptom mappings to standardized terms
-        self.symptom_mappings = {
-            "fever": ["fever", "high temperature", "hot body"],
-            "chills": ["chills", "shivering", "feeling cold"],
-            "headache": ["headache", "head pain", "severe headache"],
-            "sweating": ["sweating", "night sweats", "excessive sweating"],
-            "nausea": ["nausea", "feeling sick", "want to vomit"],
-            "vomiting": ["vomiting", "throwing up", "being sick"],
-            "fatigue": ["fatigue", "tiredness", "feeling weak"],
-            "body_aches": ["body aches", "muscle pain", "joint pain"],
-            "abdominal_pain": ["stomach pain", "belly pain", "abdominal pain"],
-            "diarrhea": ["diarrhea", "loose stool", "watery stool"],
-            "constipation": ["constipation", "hard stool", "difficulty passing stool"],
-            "cough": ["cough", "coughing", "dry cough"],
-            "sore_throat": ["sore throat", "throat pain", "painful swallowing"],
-            "runny_nose": ["runny nose", "nasal discharge", "blocked nose"],
-            "sneezing": ["sneezing", "frequent sneezing"],
-            "shortness_of_breath": ["shortness of breath", "difficulty breathing", "breathless"],
-            "pale_skin": ["pale skin", "looking pale", "loss of color"],
-            "dizziness": ["dizziness", "feeling faint", "lightheaded"],
-            "weakness": ["weakness", "feeling weak", "lack of strength"]
-        }
+    return {
+        "diagnoses": top_conditions,
+        "message": message,
+        "total_symptoms": len(all_symptoms),
+        "processed_symptoms": all_symptoms
+    }
+
+
+def _copy_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy a cached diagnosis so callers can't mutate the cache entry"""
+    copied = dict(result)
+    copied["diagnoses"] = [dict(d, matched_symptoms=list(d["matched_symptoms"]))
+                           for d in result["diagnoses"]]
+    copied["processed_symptoms"] = list(result["processed_symptoms"])
+    copied["next_questions"] = [dict(q) for q in result["next_questions"]]
+    return copied
 
-    def normalize_symptoms(self, symptoms_text: str) -> List[str]:
-        """Convert free-text symptoms to standardized symptom codes"""
+
+class DiagnosticEngine:
+    def __init__(self, knowledge_base_path: Optional[str] = None, cache_size: int = 1024,
+                 reload_interval: float = 30.0, fuzzy_matching: bool = True):
+        # Bounded LRU of diagnosis results keyed on the frozenset of symptom codes
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[frozenset, Dict[str, Any]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._cache_evictions = 0
+        self.catalog_version = 0
+
+        # Optional learned model (see bayes.LikelihoodModel) ranking conditions instead of the fixed weights
+        self.scoring_model = None
+
+        # Correct misspelled free-text words to the nearest phrase word before matching phrases
+        self.fuzzy_matching = fuzzy_matching
+
+        # Hot reload of the knowledge base file
+        self.knowledge_base_path = knowledge_base_path or DEFAULT_KNOWLEDGE_BASE_PATH
+        self.reload_interval = reload_interval
+        self._reload_lock = threading.Lock()
+        self._knowledge_base_mtime = None
+        self._next_reload_check = 0.0
+
+        self.kb: KnowledgeBase
+        self.last_modified: datetime
+        self.reload()
+
+    @property
+    def conditions(self) -> Dict[str, Dict[str, Any]]:
+        return self.kb.conditions
+
+    @property
+    def symptom_mappings(self) -> Dict[str, List[str]]:
+        return self.kb.symptom_mappings
+
+    def load_knowledge_base(self, kb: KnowledgeBase):
+        """Atomically swap in a compiled knowledge base"""
+        with self._cache_lock:
+            self.kb = kb
+            self.last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+            # Cached results were scored against the old catalog
+            self.catalog_version += 1
+            self._cache.clear()
+
+    def set_scoring_model(self, model):
+        """Swap in a learned ranking model, or None to score with the fixed weights only"""
+        with self._cache_lock:
+            self.scoring_model = model
+            self._cache.clear()
+
+    def reload(self):
+        """Load and compile the knowledge base file, then swap it in"""
+        with self._reload_lock:
+            mtime = os.stat(self.knowledge_base_path).st_mtime_ns
+            kb = KnowledgeBase.load(self.knowledge_base_path)
+            self.load_knowledge_base(kb)
+            # The file's mtime is the same in every worker, unlike the time it was loaded
+            self.last_modified = datetime.fromtimestamp(mtime // 1_000_000_000, timezone.utc)
+            self._knowledge_base_mtime = mtime
+            self._next_reload_check = time.monotonic() + self.reload_interval
+
+    def reload_if_changed(self) -> bool:
+        """Reload the knowledge base if its file changed; checks at most once per reload_interval"""
+        if self.reload_interval <= 0 or time.monotonic() < self._next_reload_check:
+            return False
+        with self._reload_lock:
+            if time.monotonic() < self._next_reload_check:
+                return False
+            self._next_reload_check = time.monotonic() + self.reload_interval
+            try:
+                changed = os.stat(self.knowledge_base_path).st_mtime_ns != self._knowledge_base_mtime
+            except OSError:
+                return False
+        if changed:
+            self.reload()
+        return changed
+
+    def cache_info(self) -> Dict[str, int]:
+        """Diagnosis cache counters"""
+        with self._cache_lock:
+            return {
+                "hits": self._cache_hits,
+                "misses": self._cache_misses,
+                "evictions": self._cache_evictions,
+                "size": len(self._cache),
+                "maxsize": self.cache_size,
+                "catalog_version": self.catalog_version,
+            }
+
+    def normalize_symptoms(self, symptoms_text: str, kb: Optional[KnowledgeBase] = None) -> List[str]:
+        """Convert free-text symptoms to standardized symptom codes.
+
+        Phrases only match on whole words, found in a single pass over the text.
+        With fuzzy matching on, misspelled words are corrected first (see fuzzy.py).
+        Like diagnose(), it uses the current knowledge base unless given one.
+        """
+        return self._normalize(symptoms_text, kb or self.kb)
+
+    def _normalize(self, symptoms_text: str, kb: KnowledgeBase) -> List[str]:
         if not symptoms_text:
             return []
-            
-        text_lower = symptoms_text.lower()
-        normalized = []
-        
-        for standard_symptom, variations in self.symptom_mappings.items():
-            for variation in variations:
-                if variation in text_lower:
-                    normalized.append(standard_symptom)
+
+        words = _tokenize(symptoms_text)
+        if self.fuzzy_matching:
+            # Known and short words are kept as they are without a call into the matcher
+            vocabulary = kb.fuzzy_matcher.vocabulary
+            correct = kb.fuzzy_matcher.correct
+            words = [word if word in vocabulary or len(word) < MIN_WORD_LENGTH else correct(word)
+                     for word in words]
+        trie = kb.phrase_trie
+        normalized = set()
+
+        word_count = len(words)
+        for start in range(word_count):
+            node = trie
+            for i in range(start, word_count):
+                node = node.get(words[i])
+                if node is None:
                     break
-                    
-        return list(set(normalized))  # Remove duplicates
+                codes = node.get(None)
+                if codes:
+                    normalized.update(codes)
+
+        return list(normalized)
 
     def calculate_condition_score(self, user_symptoms: List[str], condition: Dict[str, Any]) -> Dict[str, Any]:
         """Calculate how well user symptoms match a condition"""
-        primary_matches = sum(1 for symptom in condition["primary_symptoms"] if symptom in user_symptoms)
-        secondary_matches = sum(1 for symptom in condition["secondary_symptoms"] if symptom in user_symptoms)
-        severity_matches = sum(1 for symptom in condition["severity_indicators"] if symptom in user_symptoms)
-        
-        # Weighted scoring
-        primary_weight = 3
-        secondary_weight = 1
-        severity_weight = 2
-        
-        total_score = (primary_matches * primary_weight + 
-                      secondary_matches * secondary_weight + 
-                      severity_matches * severity_weight)
-        
-        max_possible = (len(condition["primary_symptoms"]) * primary_weight + 
-                       len(condition["secondary_symptoms"]) * secondary_weight +
-                       len(condition["severity_indicators"]) * severity_weight)
-        
+        # Work on a copy of the index so unseen codes don't leak into the shared knowledge base
+        symptom_index = dict(self.kb.symptom_index)
+        compiled = CompiledCondition(condition.get("name", ""), condition, symptom_index)
+        return self._score(_symptom_mask(user_symptoms, symptom_index), user_symptoms, compiled, symptom_index)
+
+    def _score(self, user_mask: int, user_symptoms: List[str], compiled: CompiledCondition,
+               symptom_index: Dict[str, int]) -> Dict[str, Any]:
+        """Score a compiled condition against a user symptom bitmask"""
+        condition = compiled.data
+        primary_matches = (user_mask & compiled.primary_mask).bit_count()
+        secondary_matches = (user_mask & compiled.secondary_mask).bit_count()
+        severity_matches = (user_mask & compiled.severity_mask).bit_count()
+
+        total_score = (primary_matches * PRIMARY_WEIGHT +
+                      secondary_matches * SECONDARY_WEIGHT +
+                      severity_matches * SEVERITY_WEIGHT)
+
+        max_possible = compiled.max_possible
         confidence = (total_score / max_possible) * 100 if max_possible > 0 else 0
         
         # Determine urgency level
@@ -154,7 +529,8 @@ class DiagnosticEngine:
             urgency = "high"
         elif primary_matches >= 1:
             urgency = condition["urgency"]
-            
+
+        all_mask = compiled.all_mask
         return {
             "condition": condition["name"],
             "description": condition["description"],
@@ -164,134 +540,125 @@ class DiagnosticEngine:
             "severity_matches": severity_matches,
             "recommendations": condition["recommendations"],
             "urgency": urgency,
-            "matched_symptoms": [s for s in user_symptoms if s in condition["primary_symptoms"] + condition["secondary_symptoms"] + condition["severity_indicators"]]
+            "matched_symptoms": [s for s in user_symptoms
+                                 if s in symptom_index and all_mask >> symptom_index[s] & 1]
         }
 
-    def diagnose(self, selected_symptoms: List[str], text_symptoms: str = "") -> Dict[str, Any]:
-        """Main diagnosis function"""
+    def diagnose(self, selected_symptoms: List[str], text_symptoms: str = "",
+                 kb: Optional[KnowledgeBase] = None) -> Dict[str, Any]:
+        """Main diagnosis function.
+
+        Pass the knowledge base the result will be stored against, so a reload
+        in between can't change it; defaults to the current one.
+        """
+        kb = kb or self.kb
         # Normalize and combine symptoms
-        normalized_text_symptoms = self.normalize_symptoms(text_symptoms)
+        normalized_text_symptoms = self._normalize(text_symptoms, kb)
         all_symptoms = list(set(selected_symptoms + normalized_text_symptoms))
-        
+        return self._diagnose_symptoms(all_symptoms, kb)
+
+    def diagnose_many(self, records: Iterable[Dict[str, Any]],
+                      kb: Optional[KnowledgeBase] = None) -> List[Dict[str, Any]]:
+        """Diagnose a batch of records, each with optional "symptoms" and "symptoms_text" keys.
+
+        Returns one result per record, in order, identical to calling diagnose() on each.
+        """
+        kb = kb or self.kb
+        results = []
+        normalize = self._normalize
+        for record in records:
+            selected_symptoms = list(record.get("symptoms") or [])
+            normalized_text_symptoms = normalize(record.get("symptoms_text") or "", kb)
+            results.append(self._diagnose_symptoms(list(set(selected_symptoms + normalized_text_symptoms)), kb))
+        return results
+
+    def next_questions(self, selected_symptoms: List[str], text_symptoms: str = "",
+                       absent_symptoms: Iterable[str] = (), limit: int = NEXT_QUESTIONS) -> Dict[str, Any]:
+        """Diagnose, then suggest the symptoms to ask about next.
+
+        absent_symptoms are symptoms the patient has already said they don't
+        have; they aren't suggested again and shift the suggestions towards
+        the candidates they leave most likely. The diagnosis itself only
+        scores the symptoms present, as diagnose() does.
+        """
+        kb = self.kb
+        all_symptoms = list(set(selected_symptoms + self._normalize(text_symptoms, kb)))
+        result = self._diagnose_symptoms(all_symptoms, kb)
+        absent_mask = _symptom_mask(absent_symptoms, kb.symptom_index)
+        if result["diagnoses"] and (absent_mask or limit != NEXT_QUESTIONS):
+            positions = kb.condition_positions
+            ranked = [(d["confidence"], kb.compiled_conditions[positions[d["condition"]]])
+                      for d in result["diagnoses"]]
+            user_mask = _symptom_mask(all_symptoms, kb.symptom_index)
+            result["next_questions"] = kb.next_questions(user_mask, ranked, limit, absent_mask & ~user_mask)
+        return result
+
+    def _rank_conditions(self, user_mask: int, kb: KnowledgeBase, limit: int = 3) -> List[CompiledCondition]:
+        """Return the best matching compiled conditions, most confident first"""
+        candidates = []
+        for compiled in kb.compiled_conditions:
+            if not user_mask & compiled.all_mask:
+                continue
+            confidence = compiled.confidence(user_mask)
+            if confidence > 0:  # Only include conditions with some match
+                candidates.append((confidence, compiled))
+        # nlargest is stable, so ties keep catalog order like a full sort would
+        return [compiled for _, compiled in heapq.nlargest(limit, candidates, key=lambda c: c[0])]
+
+    def _diagnose_symptoms(self, all_symptoms: List[str], kb: KnowledgeBase) -> Dict[str, Any]:
+        """Diagnose already combined symptom codes, served from the LRU cache when possible"""
+        model = self.scoring_model
+        # The cache only holds results of the current knowledge base
+        if not all_symptoms or self.cache_size <= 0 or kb is not self.kb:
+            return self._build_diagnosis(all_symptoms, kb, model)
+
+        key = frozenset(all_symptoms)
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self._cache_hits += 1
+                return _copy_result(cached)
+            self._cache_misses += 1
+
+        result = self._build_diagnosis(all_symptoms, kb, model)
+
+        with self._cache_lock:
+            # Skip storing if the knowledge base or model was swapped while we were scoring
+            if kb is self.kb and model is self.scoring_model:
+                self._cache[key] = result
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+                    self._cache_evictions += 1
+        return _copy_result(result)
+
+    def _build_diagnosis(self, all_symptoms: List[str], kb: KnowledgeBase, model=None) -> Dict[str, Any]:
+        """Score already combined symptom codes and build the diagnosis result"""
         if not all_symptoms:
-            return {
-                "diagnoses": [],
-                "message": "No symptoms provided. Please select symptoms or describe how you feel.",
-                "total_symptoms": 0
-            }
-        
-        # Calculate scores for all conditions
-        condition_scores = []
-        for condition_key, condition_data in self.conditions.items():
-            score = self.calculate_condition_score(all_symptoms, condition_data)
-            if score["confidence"] > 0:  # Only include conditions with some match
-                condition_scores.append(score)
-        
-        # Sort by confidence score
-        condition_scores.sort(key=lambda x: x["confidence"], reverse=True)
+            return _empty_result()
         
-        # Filter to top 3 most likely conditions
-        top_conditions = condition_scores[:3]
-        
-        # Generate summary message
-        if not top_conditions:
-            message = "Based on your symptoms, we cannot match them to common conditions in our database. Please consult a healthcare professional for proper evaluation."
-        elif top_conditions[0]["confidence"] > 70:
-            message = f"Your symptoms strongly suggest {top_conditions[0]['condition']}. Please seek medical attention for proper diagnosis and treatment."
-        elif top_conditions[0]["confidence"] > 40:
-            message = f"Your symptoms may indicate {top_conditions[0]['condition']} or similar conditions. Medical evaluation is recommended."
+        user_mask = _symptom_mask(all_symptoms, kb.symptom_index)
+        if model is not None and model.kb is kb:
+            # Learned ranking only. The model counts every symptom not reported as absent, which
+            # makes its posterior far too sure of itself to show, so confidence stays the rule score
+            compiled_conditions = [compiled for _, compiled in model.rank(user_mask)]
         else:
-            message = "Your symptoms match several possible conditions. A healthcare professional can provide proper diagnosis."
-            
-        return {
-            "diagnoses": top_conditions,
-            "message": message,
-            "total_symptoms": len(all_symptoms),
-            "processed_symptoms": all_symptoms
-        }
+            # Rank conditions by confidence and build full results for the top 3 only
+            compiled_conditions = self._rank_conditions(user_mask, kb)
+        top_conditions = [self._score(user_mask, all_symptoms, compiled, kb.symptom_index)
+                          for compiled in compiled_conditions]
+        ranked = [(condition["confidence"], compiled)
+                  for condition, compiled in zip(top_conditions, compiled_conditions)]
+
+        result = _diagnosis_result(top_conditions, all_symptoms)
+        result["next_questions"] = kb.next_questions(user_mask, ranked)
+        return result
 
     def get_example_symptom_bundles(self) -> List[Dict[str, Any]]:
         """Get example symptom combinations for common conditions"""
-        return [
-            {
-                "name": "Feeling feverish and weak",
-                "symptoms": ["fever", "fatigue", "headache", "body_aches"],
-                "description": "High temperature with general weakness"
-            },
-            {
-                "name": "Stomach problems",
-                "symptoms": ["abdominal_pain", "nausea", "diarrhea", "fever"],
-                "description": "Stomach pain with digestive issues"
-            },
-            {
-                "name": "Cold-like symptoms",
-                "symptoms": ["runny_nose", "sneezing", "sore_throat", "mild_cough"],
-                "description": "Common cold symptoms"
-            },
-            {
-                "name": "Feeling very tired",
-                "symptoms": ["fatigue", "weakness", "pale_skin", "shortness_of_breath"],
-                "description": "Persistent tiredness and weakness"
-            }
-        ]
+        return list(self.kb.example_bundles)
 
     def get_all_symptoms(self) -> List[Dict[str, str]]:
         """Get all available symptoms for the form"""
-        symptoms = []
-        all_symptom_codes = set()
-        
-        # Collect all unique symptoms from conditions
-        for condition in self.conditions.values():
-            all_symptom_codes.update(condition["primary_symptoms"])
-            all_symptom_codes.update(condition["secondary_symptoms"])
-            all_symptom_codes.update(condition["severity_indicators"])
-        
-        # Convert to user-friendly format
-        symptom_display = {
-            "fever": "Fever/High temperature",
-            "chills": "Chills/Shivering",
-            "headache": "Headache",
-            "sweating": "Excessive sweating",
-            "nausea": "Nausea/Feeling sick",
-            "vomiting": "Vomiting",
-            "fatigue": "Fatigue/Tiredness",
-            "body_aches": "Body aches/Muscle pain",
-            "abdominal_pain": "Stomach/Belly pain",
-            "diarrhea": "Diarrhea/Loose stool",
-            "constipation": "Constipation",
-            "cough": "Cough",
-            "sore_throat": "Sore throat",
-            "runny_nose": "Runny/Blocked nose",
-            "sneezing": "Sneezing",
-            "shortness_of_breath": "Difficulty breathing",
-            "pale_skin": "Pale skin",
-            "dizziness": "Dizziness/Feeling faint",
-            "weakness": "Weakness",
-            "high_fever": "Very high fever",
-            "severe_headache": "Severe headache",
-            "confusion": "Confusion",
-            "prolonged_fever": "Fever for several days",
-            "rose_spots": "Rose-colored spots on skin",
-            "enlarged_spleen": "Swollen abdomen",
-            "bloody_stool": "Blood in stool",
-            "difficulty_breathing": "Severe breathing problems",
-            "chest_pain": "Chest pain",
-            "persistent_vomiting": "Cannot stop vomiting",
-            "mild_cough": "Mild cough",
-            "low_fever": "Low-grade fever",
-            "congestion": "Nasal congestion",
-            "mild_headache": "Mild headache",
-            "cold_hands": "Cold hands and feet",
-            "brittle_nails": "Brittle fingernails",
-            "fast_heartbeat": "Fast heartbeat",
-            "severe_fatigue": "Extreme tiredness",
-            "irregular_heartbeat": "Irregular heartbeat"
-        }
-        
-        for code in sorted(all_symptom_codes):
-            symptoms.append({
-                "code": code,
-                "display": symptom_display.get(code, code.replace("_", " ").title())
-            })
-            
-        return symptoms
+        return list(self.kb.symptoms)
@@ -0,0 +1,178 @@
+"""
+Streaming export of submissions joined with their feedback
+Rows are read one keyset page at a time, each on a connection that is
+closed before the page is sent, so an export runs in constant memory and a
+slow client never holds a read transaction that would block other workers. Archived submissions (see
+archive.py) are merged in by id from the monthly files the filters cover
+"""
+
+import csv
+import heapq
+import io
+import json
+import sys
+import zlib
+from datetime import datetime
+from operator import attrgetter
+from typing import Any, Dict, Iterator
+
+import click
+from sqlalchemy import select
+
+import analytics
+import archive
+from app import app, read_engine
+from models import Feedback, Submission, decode_diagnosis, decode_symptoms
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+COLUMNS = [
+    "submission_id", "created_at", "name", "age", "gender", "location",
+    "symptoms", "symptoms_text", "top_condition", "top_confidence", "urgency", "diagnoses",
+    "kb_version", "feedback_accurate", "feedback_comments", "feedback_at",
+]
+
+# Rows read per query; the connection is released before they are serialized
+FETCH_SIZE = 1000
+
+# Rows serialized before a chunk of output is handed to the client
+WRITE_BATCH = 500
+
+
+def iter_rows(filters: Dict[str, Any], after: int = 0) -> Iterator[Dict[str, Any]]:
+    """Yield export rows in submission id order, starting after the given id.
+
+    filters may contain since (inclusive) and until (exclusive) datetimes,
+    location and condition (the top diagnosed condition).
+    """
+    condition = filters.get("condition")
+    rows = heapq.merge(_iter_live(filters, after), archive.iter_archived(filters, after), key=attrgetter("id"))
+    for row in rows:
+        diagnosis = decode_diagnosis(row.kb_version, row.diagnosis_data)
+        # The top condition only exists inside the encoded diagnosis
+        if condition and analytics.top_condition(diagnosis) != condition:
+            continue
+        yield _export_row(row, diagnosis)
+
+
+def _iter_live(filters: Dict[str, Any], after: int) -> Iterator[Any]:
+    """Database rows matching the filters other than condition, in submission id order"""
+    query = (
+        select(Submission.id, Submission.created_at, Submission.name, Submission.age,
+               Submission.gender, Submission.location, Submission.kb_version, Submission.symptom_ids,
+               Submission.symptoms_text, Submission.diagnosis_data,
+               Feedback.is_accurate, Feedback.comments, Feedback.created_at.label("feedback_at"))
+        .outerjoin(Feedback, Feedback.submission_id == Submission.id)
+        .order_by(Submission.id)
+        .limit(FETCH_SIZE)
+    )
+    if filters.get("since"):
+        query = query.where(Submission.created_at >= filters["since"])
+    if filters.get("until"):
+        query = query.where(Submission.created_at < filters["until"])
+    if filters.get("location"):
+        query = query.where(Submission.location == filters["location"])
+
+    while True:
+        with read_engine().connect() as conn:
+            page = conn.execute(query.where(Submission.id > after)).all()
+        yield from page
+        if len(page) < FETCH_SIZE:
+            return
+        after = page[-1].id
+
+
+def _export_row(row, diagnosis: Dict[str, Any]) -> Dict[str, Any]:
+    diagnoses = diagnosis.get("diagnoses") or []
+    top = diagnoses[0] if diagnoses else {}
+    return {
+        "submission_id": row.id,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+        "name": row.name,
+        "age": row.age,
+        "gender": row.gender,
+        "location": row.location,
+        "symptoms": decode_symptoms(row.kb_version, row.symptom_ids),
+        "symptoms_text": row.symptoms_text,
+        "top_condition": top.get("condition"),
+        "top_confidence": top.get("confidence"),
+        "urgency": top.get("urgency"),
+        "diagnoses": [{"condition": d["condition"], "confidence": d["confidence"]} for d in diagnoses],
+        "kb_version": row.kb_version,
+        "feedback_accurate": row.is_accurate,
+        "feedback_comments": row.comments,
+        "feedback_at": row.feedback_at.isoformat() if row.feedback_at else None,
+    }
+
+
+def iter_csv(rows: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for count, row in enumerate(rows, 1):
+        row = dict(row, symptoms=";".join(row["symptoms"]),
+                   diagnoses=json.dumps(row["diagnoses"]) if row["diagnoses"] else "")
+        writer.writerow(["" if row[column] is None else row[column] for column in COLUMNS])
+        if count % WRITE_BATCH == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_ndjson(rows: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row) + "\n")
+        if len(lines) >= WRITE_BATCH:
+            yield "".join(lines)
+            lines = []
+    yield "".join(lines)
+
+
+def gzip_chunks(chunks: Iterator[str]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(fmt: str, filters: Dict[str, Any], after: int = 0, compress: bool = False) -> Iterator:
+    """Serialized export output, as str chunks or gzip-compressed bytes"""
+    serialize = iter_csv if fmt == "csv" else iter_ndjson
+    chunks = serialize(iter_rows(filters, after))
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def filename(fmt: str, compress: bool = False) -> str:
+    name = f"ghanadiag-export-{datetime.utcnow():%Y%m%d-%H%M%S}.{fmt}"
+    return name + ".gz" if compress else name
+
+
+@app.cli.command("export")
+@click.option("--format", "fmt", type=click.Choice(sorted(FORMATS)), default="csv", show_default=True)
+@click.option("--output", "-o", type=click.Path(dir_okay=False, writable=True),
+              help="File to write (default: standard output).")
+@click.option("--gzip", "compress", is_flag=True, help="Compress the output with gzip.")
+@click.option("--since", type=click.DateTime(), help="Only submissions created at or after this time.")
+@click.option("--until", type=click.DateTime(), help="Only submissions created before this time.")
+@click.option("--location", help="Only submissions from this location.")
+@click.option("--condition", help="Only submissions whose top diagnosis is this condition.")
+@click.option("--after", type=int, default=0, help="Resume after this submission id.")
+def export_command(fmt, output, compress, since, until, location, condition, after):
+    """Export submissions and their feedback as CSV or NDJSON."""
+    filters = {"since": since, "until": until, "location": location, "condition": condition}
+    stream = open(output, "wb") if output else sys.stdout.buffer
+    try:
+        for chunk in export_chunks(fmt, filters, after, compress):
+            stream.write(chunk if compress else chunk.encode("utf-8"))
+    finally:
+        if output:
+            stream.close()
+        else:
+            stream.flush()
@@ -0,0 +1,140 @@
+"""
+Misspelling-tolerant matching of free-text symptom words
+Words the knowledge base's phrases don't contain are corrected to the
+closest phrase word within a bounded edit distance, so "diarhea",
+"headach" and "vomitting" still reach the phrase trie. Candidates come
+from a character-trigram inverted index; only words sharing enough
+trigrams with the typed word have their distance computed.
+"""
+
+from typing import Dict, Iterable, List, Set, Tuple
+
+# Shorter words are neither corrected nor corrected to: they have too many close
+# neighbours ("back" and "black", "could" and "cold")
+MIN_WORD_LENGTH = 5
+MAX_EDIT_DISTANCE = 2
+# 1 - distance / length of the longer word; one typo in a five-letter word is exactly 0.8
+MIN_SIMILARITY = 0.8
+# Corrections remembered per knowledge base; notes repeat the same words over and over
+MEMO_SIZE = 50000
+
+
+def trigrams(word: str) -> Set[str]:
+    """Distinct character trigrams of a word, padded so its first and last letters count"""
+    padded = f"^{word}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def distance_limit(length: int) -> int:
+    """Largest edit distance that can still meet MIN_SIMILARITY for a word of this length"""
+    limit = 0
+    while limit < MAX_EDIT_DISTANCE and 1 - (limit + 1) / (length + limit + 1) >= MIN_SIMILARITY:
+        limit += 1
+    return limit
+
+
+def match_vectors(word: str) -> Dict[str, int]:
+    """Bitmask of the positions of each character in word"""
+    vectors: Dict[str, int] = {}
+    for i, char in enumerate(word):
+        vectors[char] = vectors.get(char, 0) | 1 << i
+    return vectors
+
+
+def osa_distance(text: str, pattern: str, vectors: Dict[str, int]) -> int:
+    """Optimal string alignment distance (edits plus adjacent swaps) between text and pattern.
+
+    Hyyrö's bit-parallel algorithm: each column of the distance matrix is a
+    few integer operations on pattern's precomputed match_vectors.
+    """
+    length = len(pattern)
+    if not length:
+        return len(text)
+    mask = (1 << length) - 1
+    last = 1 << (length - 1)
+    vp, vn, d0, previous_match = mask, 0, 0, 0
+    score = length
+    for char in text:
+        match = vectors.get(char, 0)
+        d0 = ((~d0 & match) << 1 & previous_match) | (((match & vp) + vp) ^ vp) | match | vn
+        hp = vn | (~(d0 | vp) & mask)
+        hn = d0 & vp
+        if hp & last:
+            score += 1
+        elif hn & last:
+            score -= 1
+        hp = (hp << 1 | 1) & mask
+        hn = hn << 1 & mask
+        vp = hn | (~(d0 | hp) & mask)
+        vn = hp & d0
+        previous_match = match
+    return score
+
+
+class FuzzyMatcher:
+    """Corrects words against a fixed vocabulary; built once per knowledge base"""
+    __slots__ = ("vocabulary", "_index", "_vectors", "_lengths", "_memo")
+
+    def __init__(self, words: Iterable[str]):
+        self.vocabulary = frozenset(words)
+        index: Dict[str, List[str]] = {}
+        self._vectors: Dict[str, Dict[str, int]] = {}
+        # first letter -> lengths of the vocabulary words starting with it
+        self._lengths: Dict[str, Set[int]] = {}
+        for word in sorted(self.vocabulary):
+            if len(word) < MIN_WORD_LENGTH:
+                continue
+            self._vectors[word] = match_vectors(word)
+            self._lengths.setdefault(word[0], set()).add(len(word))
+            # Keyed by first letter too, since only words starting with the same letter are candidates
+            for gram in trigrams(word):
+                index.setdefault(word[0] + gram, []).append(word)
+        self._index: Dict[str, Tuple[str, ...]] = {gram: tuple(entries) for gram, entries in index.items()}
+        self._memo: Dict[str, str] = {}
+
+    def correct(self, word: str) -> str:
+        """The closest vocabulary word, or word unchanged if it is known or nothing is close enough"""
+        if word in self.vocabulary or len(word) < MIN_WORD_LENGTH:
+            return word
+        memo = self._memo
+        corrected = memo.get(word)
+        if corrected is None:
+            corrected = self._closest(word)
+            if len(memo) >= MEMO_SIZE:
+                memo.clear()
+            memo[word] = corrected
+        return corrected
+
+    def _closest(self, word: str) -> str:
+        """Search the index for word's nearest neighbour.
+
+        Candidates must start with the same letter; first letters are rarely
+        mistyped, and it keeps "rough" from becoming "cough". Ties go to the
+        alphabetically first word.
+        """
+        length = len(word)
+        limit = distance_limit(length)
+        first = word[0]
+        if not any(abs(candidate_length - length) <= limit for candidate_length in self._lengths.get(first, ())):
+            return word
+
+        grams = trigrams(word)
+        # An edit changes at most three trigrams, an adjacent swap four
+        needed = len(grams) - 4 * limit
+        shared: Dict[str, int] = {}
+        index = self._index
+        for gram in grams:
+            for candidate in index.get(first + gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+
+        best = None
+        vectors = self._vectors
+        for candidate, count in shared.items():
+            if count < needed or abs(len(candidate) - length) > limit:
+                continue
+            distance = osa_distance(word, candidate, vectors[candidate])
+            if distance > limit or 1 - distance / max(length, len(candidate)) < MIN_SIMILARITY:
+                continue
+            if best is None or (distance, candidate) < best:
+                best = (distance, candidate)
+        return best[1] if best else word
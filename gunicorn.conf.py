@@ -0,0 +1,56 @@
+"""
+Production server settings, read automatically by gunicorn from the working directory
+
+The app is imported once in the master process and workers are forked from
+it, so the compiled diagnostic engine and knowledge base are shared
+copy-on-write instead of being rebuilt in every worker.
+
+    WEB_CONCURRENCY      worker processes (default: 2 x CPUs + 1)
+    GUNICORN_THREADS     threads per worker (default: 4)
+    GUNICORN_PRELOAD     import the app before forking (default: 1; set 0 with --reload)
+    MIGRATE_ON_START     run the schema migration once in the master (default: 1)
+    PORT                 port to listen on (default: 5000)
+"""
+
+import gc
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", "4"))
+worker_class = "gthread" if threads > 1 else "sync"
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    """Create and upgrade the schema once, before any worker serves requests"""
+    if os.environ.get("MIGRATE_ON_START", "1") != "1":
+        return
+    from app import app, db
+    import migrations
+    with app.app_context():
+        migrations.upgrade()
+        # Workers must not inherit the master's pooled connections
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def when_ready(server):
+    # Move everything loaded so far out of the collector's reach, so collections
+    # in workers don't write to (and un-share) the preloaded objects' pages
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return
+    from app import app, db
+    with app.app_context():
+        # Drop pooled connections inherited from the master without closing them under its feet
+        for engine in db.engines.values():
+            engine.dispose(close=False)
@@ -0,0 +1,189 @@
+"""
+Per-request instrumentation
+Timing spans, SQL query counts and latency histograms exposed in the
+Prometheus text format, plus an opt-in per-request cProfile
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_DISABLED_SPAN = nullcontext()
+
+
+class Histogram:
+    """A labelled Prometheus-style histogram, safe to update from several threads"""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # labels -> [bucket counts..., sum, count]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            label_text = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            prefix = label_text + "," if label_text else ""
+            for bound, count in zip(self.buckets, series):
+                yield f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}'
+            yield f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}'
+            yield f"{self.name}_sum{{{label_text}}} {series[-2]}"
+            yield f"{self.name}_count{{{label_text}}} {series[-1]}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Instrumentation:
+    """Collects request, stage and SQL metrics for one Flask app.
+
+    Nothing is hooked up unless enabled, and span() then returns a shared
+    no-op context manager, so disabled instrumentation costs one attribute
+    check per span.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.profile_enabled = False
+        self.profile_dir = None
+        self._collectors: List[Callable[[], Iterable[str]]] = []
+        self.request_duration = Histogram(
+            "ghanadiag_request_duration_seconds", "Request latency by endpoint",
+            ("endpoint", "method", "status"))
+        self.stage_duration = Histogram(
+            "ghanadiag_stage_duration_seconds", "Latency of instrumented stages within a request",
+            ("endpoint", "stage"))
+        self.sql_duration = Histogram(
+            "ghanadiag_sql_query_duration_seconds", "SQL statement latency by endpoint",
+            ("endpoint",))
+        self.sql_queries = Histogram(
+            "ghanadiag_sql_queries_per_request", "SQL statements executed per request",
+            ("endpoint",), buckets=QUERY_COUNT_BUCKETS)
+
+    def init_app(self, app, enabled: bool = True, profile: bool = False, profile_dir: str = None):
+        self.enabled = enabled
+        self.profile_enabled = profile
+        self.profile_dir = profile_dir or os.path.join(app.instance_path, "profiles")
+        if not enabled:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def register_collector(self, collector: Callable[[], Iterable[str]]):
+        """Add a callable returning extra metric lines for /metrics; usable as a decorator"""
+        self._collectors.append(collector)
+        return collector
+
+    def span(self, stage: str):
+        """Time a stage of the current request"""
+        if not self.enabled or not has_request_context():
+            return _DISABLED_SPAN
+        return self._span(stage)
+
+    @contextmanager
+    def _span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            g.instrumentation_spans.append((stage, elapsed))
+            self.stage_duration.observe((request.endpoint or "unknown", stage), elapsed)
+
+    def render(self) -> str:
+        lines = []
+        for histogram in (self.request_duration, self.stage_duration, self.sql_duration, self.sql_queries):
+            lines.extend(histogram.render())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+    def _before_request(self):
+        g.instrumentation_start = time.perf_counter()
+        g.instrumentation_spans = []
+        g.instrumentation_sql = [0, 0.0]
+        if self.profile_enabled and request.headers.get("X-Profile"):
+            g.instrumentation_profiler = cProfile.Profile()
+            g.instrumentation_profiler.enable()
+
+    def _after_request(self, response):
+        start = g.pop("instrumentation_start", None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or "unknown"
+        query_count, query_time = g.instrumentation_sql
+        self.request_duration.observe((endpoint, request.method, str(response.status_code)), elapsed)
+        self.sql_queries.observe((endpoint,), query_count)
+
+        timings = [f'{stage};dur={duration * 1000:.2f}' for stage, duration in g.instrumentation_spans]
+        timings.append(f"sql;desc=\"{query_count} queries\";dur={query_time * 1000:.2f}")
+        timings.append(f"total;dur={elapsed * 1000:.2f}")
+        response.headers["Server-Timing"] = ", ".join(timings)
+
+        profiler = g.pop("instrumentation_profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            self._save_profile(profiler, endpoint)
+        return response
+
+    def _save_profile(self, profiler, endpoint: str):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{endpoint}.prof")
+        profiler.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(20)
+        current_app.logger.info(f"Profile for {endpoint} saved to {path}\n{summary.getvalue()}")
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("instrumentation_query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("instrumentation_query_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        # The write-behind thread runs queries outside any request
+        if not has_request_context() or "instrumentation_sql" not in g:
+            self.sql_duration.observe(("background",), elapsed)
+            return
+        g.instrumentation_sql[0] += 1
+        g.instrumentation_sql[1] += elapsed
+        self.sql_duration.observe((request.endpoint or "unknown",), elapsed)
+
+
+instrumentation = Instrumentation()
@@ -1,4 +1,9 @@
 from app import app
+import routes  # noqa: F401  (registers the views)
+import migrations  # noqa: F401  (registers the migrate command)
 
 if __name__ == '__main__':
+    # Development server; production runs gunicorn with gunicorn.conf.py
+    with app.app_context():
+        migrations.upgrade()
     app.run(debug=True)
@@ -0,0 +1,145 @@
+"""
+Database schema migrations
+Run with: flask --app main migrate
+"""
+
+import os
+
+from sqlalchemy import JSON, bindparam, column, func, inspect, select, table, text
+
+import analytics
+import bayes
+from app import app, db
+from diagnostic_engine import DEFAULT_KNOWLEDGE_BASE_PATH, KnowledgeBase
+from models import ConditionStat, HourlyConditionStat, Submission, decode_diagnosis, decode_symptoms, encode_submission
+
+# Rows converted per transaction
+BATCH_SIZE = 1000
+
+# Rollups analytics.rebuild_rollups fills from the submissions already stored
+ROLLUP_MODELS = [ConditionStat, HourlyConditionStat]
+
+
+def upgrade():
+    """Bring the database schema up to date; safe to run repeatedly"""
+    db.create_all()
+    _compact_submissions()
+    _add_missing_columns()
+    _dedupe_feedback()
+    _create_missing_indexes()
+    _backfill_rollups()
+
+
+def _backfill_rollups():
+    """Count the submissions stored before the rollup tables existed"""
+    with db.engine.connect() as conn:
+        has_submissions = conn.execute(select(Submission.id).limit(1)).first() is not None
+        empty = [model.__tablename__ for model in ROLLUP_MODELS
+                 if conn.execute(select(model.id).limit(1)).first() is None]
+    if not has_submissions or not empty:
+        return
+    count = analytics.rebuild_rollups()
+    app.logger.info(f"Backfilled {', '.join(empty)} from existing submissions ({count} rollup rows)")
+
+
+def _columns(table_name):
+    return {c["name"] for c in inspect(db.engine).get_columns(table_name)}
+
+
+def _add_missing_columns():
+    """create_all doesn't alter existing tables; add any nullable columns they lack"""
+    existing_tables = set(inspect(db.engine).get_table_names())
+    for model_table in db.metadata.sorted_tables:
+        if model_table.name not in existing_tables:
+            continue
+        existing = _columns(model_table.name)
+        for model_column in model_table.columns:
+            if model_column.name in existing or not model_column.nullable:
+                continue
+            column_type = model_column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {model_table.name} ADD COLUMN {model_column.name} {column_type}"))
+            app.logger.info(f"Added column {model_table.name}.{model_column.name}")
+
+
+def _dedupe_feedback():
+    """Keep only the latest feedback per submission so its unique index can be built"""
+    if "ux_feedback_submission_id" in {i["name"] for i in inspect(db.engine).get_indexes("feedback")}:
+        return
+    feedback = table("feedback", column("id"), column("submission_id"))
+    latest = select(func.max(feedback.c.id)).group_by(feedback.c.submission_id)
+    with db.engine.begin() as conn:
+        deleted = conn.execute(feedback.delete().where(feedback.c.id.not_in(latest))).rowcount
+    if deleted:
+        # The rollups and likelihood counts included the removed rows
+        analytics.rebuild_rollups()
+        bayes.rebuild_counts()
+        app.logger.info(f"Removed {deleted} duplicate feedback rows and rebuilt the rollups")
+
+
+def _create_missing_indexes():
+    """create_all only builds indexes for tables it creates itself"""
+    for model_table in db.metadata.sorted_tables:
+        for index in model_table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+def _compact_submissions():
+    """Convert submissions stored as full JSON into symptom IDs and diagnosis tuples"""
+    columns = _columns("submission")
+    if "symptom_ids" not in columns:
+        with db.engine.begin() as conn:
+            conn.execute(text("ALTER TABLE submission ADD COLUMN kb_version VARCHAR(64)"))
+            conn.execute(text("ALTER TABLE submission ADD COLUMN symptom_ids JSON NOT NULL DEFAULT '[]'"))
+            conn.execute(text("ALTER TABLE submission ADD COLUMN diagnosis_data JSON NOT NULL DEFAULT '{}'"))
+    if "diagnosis" not in columns:
+        return
+
+    kb = KnowledgeBase.load(os.environ.get("KNOWLEDGE_BASE_PATH") or DEFAULT_KNOWLEDGE_BASE_PATH)
+    legacy = table("submission", column("id"), column("symptoms_selected", JSON), column("diagnosis", JSON),
+                   column("kb_version"), column("symptom_ids", JSON), column("diagnosis_data", JSON))
+    update = (legacy.update()
+              .where(legacy.c.id == bindparam("row_id"))
+              .values(kb_version=bindparam("kb_version"), symptom_ids=bindparam("symptom_ids"),
+                      diagnosis_data=bindparam("diagnosis_data")))
+
+    converted = kept_in_full = 0
+    last_id = 0
+    while True:
+        with db.engine.begin() as conn:
+            rows = conn.execute(
+                select(legacy.c.id, legacy.c.symptoms_selected, legacy.c.diagnosis)
+                .where(legacy.c.id > last_id).order_by(legacy.c.id).limit(BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            params = []
+            for row_id, symptoms_selected, diagnosis in rows:
+                values = encode_submission(kb, symptoms_selected or [], diagnosis)
+                # Only keep the compact form if it rebuilds exactly what was stored
+                if decode_symptoms(values["kb_version"], values["symptom_ids"]) != symptoms_selected:
+                    values = {"kb_version": None, "symptom_ids": symptoms_selected or [], "diagnosis_data": diagnosis}
+                elif decode_diagnosis(values["kb_version"], values["diagnosis_data"]) != diagnosis:
+                    values["diagnosis_data"] = diagnosis
+                if values["diagnosis_data"] is diagnosis:
+                    kept_in_full += 1
+                params.append({"row_id": row_id, **values})
+            conn.execute(update, params)
+            converted += len(rows)
+            last_id = rows[-1][0]
+
+    with db.engine.begin() as conn:
+        conn.execute(text("ALTER TABLE submission DROP COLUMN symptoms_selected"))
+        conn.execute(text("ALTER TABLE submission DROP COLUMN diagnosis"))
+    if db.engine.dialect.name == "sqlite":
+        # Reclaim the space the JSON blobs used
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
+    app.logger.info(f"Compacted {converted} submissions ({kept_in_full} diagnoses kept in full)")
+
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Create missing tables and indexes and convert stored data to the current format."""
+    upgrade()
+    print("Database is up to date")
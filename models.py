@@ -1,6 +1,26 @@
 from app import db
 from datetime import datetime
-from sqlalchemy import Text, JSON
+from functools import cached_property
+from sqlalchemy import Text, JSON, insert, select
+from sqlalchemy.exc import IntegrityError
+from diagnostic_engine import KnowledgeBase
+
+# Compiled knowledge bases by storage key, for decoding stored submissions
+_knowledge_bases = {}
+_stored_knowledge_bases = set()
+
+
+def insert_for_dialect():
+    """Return the current database's INSERT construct if it supports ON CONFLICT, else None"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
+
 
 class Submission(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -11,17 +31,39 @@ class Submission(db.Model):
     gender = db.Column(db.String(20), nullable=True)
     location = db.Column(db.String(100), nullable=True)
     
-    # Symptoms and diagnosis
-    symptoms_selected = db.Column(JSON, nullable=False)  # List of selected symptoms
+    # Symptoms and diagnosis, stored compactly against a knowledge base version
+    kb_version = db.Column(db.String(64), nullable=True)  # KnowledgeBase.storage_key
+    symptom_ids = db.Column(JSON, nullable=False)  # Selected symptom IDs; unknown codes kept as strings
     symptoms_text = db.Column(Text, nullable=True)  # Free-text symptoms
-    diagnosis = db.Column(JSON, nullable=False)  # Diagnosis results
+    diagnosis_data = db.Column(JSON, nullable=False)  # Encoded diagnosis, or the full result if it couldn't be encoded
     
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # ID generated by an offline client, so a re-sent assessment isn't stored twice
+    client_id = db.Column(db.String(64), nullable=True)
     
     # Relationship to feedback
     feedback = db.relationship('Feedback', backref='submission', uselist=False, cascade='all, delete-orphan')
+
+    # (created_at, id) supports keyset pagination of history and finding rows past retention;
+    # (location, created_at) serves exports filtered by location and date
+    __table_args__ = (
+        db.Index('ix_submission_created_at_id', 'created_at', 'id'),
+        db.Index('ix_submission_location_created_at', 'location', 'created_at'),
+        db.Index('ux_submission_client_id', 'client_id', unique=True),
+    )
     
+    @cached_property
+    def symptoms_selected(self):
+        """List of selected symptom codes"""
+        return decode_symptoms(self.kb_version, self.symptom_ids)
+
+    @cached_property
+    def diagnosis(self):
+        """Diagnosis result as returned by DiagnosticEngine.diagnose"""
+        return decode_diagnosis(self.kb_version, self.diagnosis_data)
+
     def __repr__(self):
         return f'<Submission {self.id}>'
 
@@ -35,6 +77,170 @@ class Feedback(db.Model):
     
     # Timestamp
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # One feedback per submission; an index rather than a constraint so migrate can add it to existing tables
+    __table_args__ = (
+        db.Index('ux_feedback_submission_id', 'submission_id', unique=True),
+    )
     
     def __repr__(self):
         return f'<Feedback {self.id} for Submission {self.submission_id}>'
+
+
+def upsert_feedback(submission_id, is_accurate, comments):
+    """Save a submission's feedback, replacing any earlier one, in the current transaction.
+
+    Returns the earlier is_accurate value, or None if this is the first
+    feedback. First feedback is a single INSERT ... ON CONFLICT DO NOTHING;
+    only when it conflicts is the existing row locked and updated.
+    """
+    insert_stmt = insert_for_dialect()
+    if insert_stmt is not None:
+        result = db.session.execute(
+            insert_stmt(Feedback)
+            .values(submission_id=submission_id, is_accurate=is_accurate, comments=comments,
+                    created_at=datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=['submission_id'])
+        )
+        if result.rowcount:
+            return None
+    existing = db.session.execute(
+        select(Feedback).filter_by(submission_id=submission_id).with_for_update()
+    ).scalar_one_or_none()
+    if existing is None:
+        db.session.add(Feedback(submission_id=submission_id, is_accurate=is_accurate, comments=comments))
+        return None
+    previous = existing.is_accurate
+    existing.is_accurate = is_accurate
+    existing.comments = comments
+    return previous
+
+class ConditionStat(db.Model):
+    """Rollup of submissions and feedback per top condition, location, age band and week"""
+    id = db.Column(db.Integer, primary_key=True)
+
+    condition = db.Column(db.String(100), nullable=False)
+    location = db.Column(db.String(100), nullable=False)
+    age_band = db.Column(db.String(20), nullable=False)
+    week_start = db.Column(db.Date, nullable=False)
+
+    # Counters
+    submissions = db.Column(db.Integer, nullable=False, default=0)
+    feedback = db.Column(db.Integer, nullable=False, default=0)
+    accurate = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('condition', 'location', 'age_band', 'week_start',
+                            name='uq_condition_stat_key'),
+    )
+
+    def __repr__(self):
+        return f'<ConditionStat {self.condition} {self.location} {self.age_band} {self.week_start}>'
+
+class HourlyConditionStat(db.Model):
+    """Submissions per top condition, location and hour, for outbreak surveillance"""
+    id = db.Column(db.Integer, primary_key=True)
+
+    condition = db.Column(db.String(100), nullable=False)
+    location = db.Column(db.String(100), nullable=False)
+    hour = db.Column(db.DateTime, nullable=False)
+
+    submissions = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('hour', 'location', 'condition', name='uq_hourly_condition_stat_key'),
+    )
+
+    def __repr__(self):
+        return f'<HourlyConditionStat {self.condition} {self.location} {self.hour}>'
+
+class KnowledgeBaseVersion(db.Model):
+    """Every knowledge base version submissions were stored against"""
+    storage_key = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.String(32), nullable=False)
+    content = db.Column(JSON, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<KnowledgeBaseVersion {self.storage_key}>'
+
+
+def register_knowledge_base(kb):
+    _knowledge_bases[kb.storage_key] = kb
+
+
+def store_knowledge_base(kb):
+    """Save kb's content once so rows encoded with it can be decoded by any worker later"""
+    register_knowledge_base(kb)
+    if kb.storage_key in _stored_knowledge_bases:
+        return
+    table = KnowledgeBaseVersion.__table__
+    try:
+        with db.engine.begin() as conn:
+            exists = conn.execute(select(table.c.storage_key).where(table.c.storage_key == kb.storage_key)).first()
+            if not exists:
+                conn.execute(insert(table).values(storage_key=kb.storage_key, version=kb.version,
+                                                  content=kb.data, created_at=datetime.utcnow()))
+    except IntegrityError:
+        pass  # Another worker stored it first
+    _stored_knowledge_bases.add(kb.storage_key)
+
+
+def get_knowledge_base(storage_key):
+    kb = _knowledge_bases.get(storage_key)
+    if kb is None:
+        row = db.session.get(KnowledgeBaseVersion, storage_key)
+        if row is None:
+            raise LookupError(f"Unknown knowledge base version {storage_key}")
+        kb = _knowledge_bases[storage_key] = KnowledgeBase(row.content)
+    return kb
+
+
+def encode_submission(kb, symptoms_selected, diagnosis):
+    """Column values for storing selected symptoms and a diagnosis produced with kb"""
+    store_knowledge_base(kb)
+    diagnosis_data = kb.encode_diagnosis(diagnosis)
+    return {
+        'kb_version': kb.storage_key,
+        'symptom_ids': kb.encode_symptoms(symptoms_selected),
+        # Results naming conditions kb doesn't have are kept in full
+        'diagnosis_data': diagnosis if diagnosis_data is None else diagnosis_data,
+    }
+
+
+def decode_symptoms(kb_version, symptom_ids):
+    if kb_version is None:
+        return list(symptom_ids)
+    return get_knowledge_base(kb_version).decode_symptoms(symptom_ids)
+
+
+def decode_diagnosis(kb_version, diagnosis_data):
+    if kb_version is None or 'diagnoses' in diagnosis_data:
+        return diagnosis_data
+    return get_knowledge_base(kb_version).decode_diagnosis(diagnosis_data)
+
+
+class IdBlock(db.Model):
+    """Next free primary key per table, handed out to workers in blocks"""
+    name = db.Column(db.String(50), primary_key=True)
+    next_id = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<IdBlock {self.name} next={self.next_id}>'
+
+class LikelihoodCount(db.Model):
+    """Feedback-confirmed diagnoses per condition and symptom, for naive-Bayes scoring.
+
+    The row with an empty symptom counts every confirmed submission of the condition.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    condition = db.Column(db.String(100), nullable=False)
+    symptom = db.Column(db.String(100), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('condition', 'symptom', name='uq_likelihood_count_key'),
+    )
+
+    def __repr__(self):
+        return f'<LikelihoodCount {self.condition} {self.symptom or "*"}={self.count}>'
@@ -0,0 +1,65 @@
+"""
+Precomputed responses for pages that only change with the knowledge base
+Bodies are rendered and gzipped once per knowledge base version and served
+with ETag and Last-Modified, so revalidating clients get a 304
+"""
+
+import gzip
+import hashlib
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from flask import Response, request
+
+
+class CachedBody:
+    """A response body with its gzipped variant and entity tag"""
+    __slots__ = ("body", "gzipped", "etag", "mimetype")
+
+    def __init__(self, body: bytes, mimetype: str):
+        self.body = body
+        # mtime=0 keeps the bytes, and so the ETag, identical across workers
+        self.gzipped = gzip.compress(body, compresslevel=9, mtime=0)
+        self.etag = hashlib.sha1(body).hexdigest()[:20]
+        self.mimetype = mimetype
+
+
+class ResponseCache:
+    """Cached bodies for the current knowledge base version; older versions are dropped"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version: Optional[str] = None
+        self._bodies: Dict[str, CachedBody] = {}
+
+    def get(self, version: str, key: str, build: Callable[[], CachedBody]) -> CachedBody:
+        bodies = self._bodies
+        if self._version == version and key in bodies:
+            return bodies[key]
+        cached = build()
+        with self._lock:
+            if self._version != version:
+                self._version = version
+                self._bodies = {}
+            self._bodies[key] = cached
+        return cached
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+            self._bodies = {}
+
+
+def cached_response(cached: CachedBody, last_modified: datetime, cache_control: str) -> Response:
+    """Serve a cached body, gzipped when the client accepts it, answering revalidation with 304"""
+    use_gzip = request.accept_encodings["gzip"] > 0
+    response = Response(cached.gzipped if use_gzip else cached.body, mimetype=cached.mimetype)
+    if use_gzip:
+        response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    # Each encoding is a different representation, so it needs its own tag
+    response.set_etag(cached.etag + ("-gz" if use_gzip else ""))
+    response.last_modified = last_modified
+    response.headers["Cache-Control"] = cache_control
+    return response.make_conditional(request)
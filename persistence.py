@@ -0,0 +1,351 @@
+"""
+Write-behind persistence for submissions
+Submissions get their IDs up front from preallocated blocks, are appended to
+a local spool file and then group-committed by a background writer thread
+"""
+
+import atexit
+import fcntl
+import glob
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert, select, update
+
+import analytics
+from app import db
+from models import IdBlock, Submission, insert_for_dialect
+
+# Rows per INSERT when replaying a spool
+RECOVERY_CHUNK = 500
+
+# Longest wait, in seconds, between attempts to commit a batch while the database is unavailable
+MAX_RETRY_DELAY = 30.0
+
+_STOP = object()
+
+
+class IdAllocator:
+    """Hands out primary keys from blocks reserved in the id_block table.
+
+    Each reservation is one short transaction on its own connection, so
+    workers only touch the shared counter once per block.
+    """
+
+    def __init__(self, app, model, block_size: int = 100):
+        self.app = app
+        self.model = model
+        self.name = model.__tablename__
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._next = 0
+        self._end = 0
+
+    def allocate(self) -> int:
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, count: int) -> List[int]:
+        with self._lock:
+            # A forked worker must not hand out what is left of its parent's block
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._next = self._end = 0
+            ids = []
+            while len(ids) < count:
+                if self._next >= self._end:
+                    self._next, self._end = self._reserve(max(self.block_size, count - len(ids)))
+                take = min(count - len(ids), self._end - self._next)
+                ids.extend(range(self._next, self._next + take))
+                self._next += take
+            return ids
+
+    def _reserve(self, size: int):
+        with self.app.app_context(), db.engine.begin() as conn:
+            table = IdBlock.__table__
+            advance = (
+                update(table).where(table.c.name == self.name)
+                .values(next_id=table.c.next_id + size)
+                .returning(table.c.next_id - size)
+            )
+            start = conn.execute(advance).scalar()
+            if start is None:
+                # First reservation: continue after any rows inserted before the allocator existed.
+                # Workers starting together may all get here; one seeds the row and each then advances it.
+                first = (conn.execute(select(db.func.max(self.model.id))).scalar() or 0) + 1
+                insert_stmt = insert_for_dialect()
+                if insert_stmt is not None:
+                    conn.execute(insert_stmt(table).values(name=self.name, next_id=first)
+                                 .on_conflict_do_nothing(index_elements=['name']))
+                else:
+                    conn.execute(insert(table).values(name=self.name, next_id=first))
+                start = conn.execute(advance).scalar()
+        return start, start + size
+
+
+def submission_row(submission: Submission) -> Dict[str, Any]:
+    """Column values of a not yet persisted Submission, for SubmissionWriter.submit"""
+    return {column.name: getattr(submission, column.name) for column in Submission.__table__.columns}
+
+
+def _to_spool(row: Dict[str, Any]) -> str:
+    record = dict(row)
+    record["created_at"] = row["created_at"].isoformat()
+    return json.dumps(record)
+
+
+def _from_spool(line: str) -> Dict[str, Any]:
+    row = json.loads(line)
+    row["created_at"] = datetime.fromisoformat(row["created_at"])
+    if "diagnosis" in row:
+        # Spooled before submissions were stored compactly; keep it in full
+        row["kb_version"] = None
+        row["symptom_ids"] = row.pop("symptoms_selected") or []
+        row["diagnosis_data"] = row.pop("diagnosis")
+    # Spooled before offline sync existed
+    row.setdefault("client_id", None)
+    return row
+
+
+class SubmissionWriter:
+    """Queues submission rows and group-commits them from a background thread.
+
+    Every row is appended to a per-process spool file before it is queued, so
+    rows that were accepted but not committed when a worker crashed are
+    replayed by the next writer to start. Spool segments are deleted once all
+    of their rows are committed. A batch that fails to commit is retried with
+    backoff until it succeeds, keeping its rows pending, or the writer closes.
+    """
+
+    def __init__(self, app, spool_dir: str, enabled: bool = True, max_batch: int = 200,
+                 max_delay: float = 0.05, segment_rows: int = 1000):
+        self.app = app
+        self.spool_dir = spool_dir
+        self.enabled = enabled
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.segment_rows = segment_rows
+        self.ids = IdAllocator(app, Submission)
+
+        self._pid = None
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+        self._lock_file = None
+        self._segment = 0
+        self._segment_file = None
+        self._segment_count = 0
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        self._idle = threading.Condition()
+        self._closing = threading.Event()
+        # Set while a batch is failing to commit
+        self._gave_up = False
+
+    def submit(self, row: Dict[str, Any]):
+        """Persist a submission row that already has its id and created_at set"""
+        if not self.enabled:
+            self._write([row])
+            return
+
+        self._ensure_started()
+        with self._idle:
+            self._pending[row["id"]] = row
+        with self._spool_lock:
+            self._segment_file.write(_to_spool(row) + "\n")
+            self._segment_file.flush()
+            os.fsync(self._segment_file.fileno())
+            self._queue.put((self._segment, row))
+            self._segment_count += 1
+            if self._segment_count >= self.segment_rows:
+                self._open_segment(self._segment + 1)
+
+    def is_pending(self, submission_id: int) -> bool:
+        return submission_id in self._pending
+
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued row is committed; returns False on timeout"""
+        with self._idle:
+            return self._idle.wait_for(lambda: not self._pending, timeout)
+
+    def close(self, timeout: float = 30.0):
+        """Drain the queue and stop the writer thread"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._queue.put(_STOP)
+        # Stops a batch that is still being retried; the spool keeps its rows for the next writer
+        self._closing.set()
+        self._thread.join(timeout)
+        self._thread = None
+        if self._drained():
+            os.remove(self._lock_file.name)
+        self._lock_file.close()
+        self._pid = None
+
+    def _drained(self) -> bool:
+        return not self._pending and not self._gave_up
+
+    def _ensure_started(self):
+        # The thread and spool belong to one process, so start them lazily after a fork
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(self.spool_dir, exist_ok=True)
+            self._lock_file = open(os.path.join(self.spool_dir, f"writer-{os.getpid()}.lock"), "w")
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._queue = queue.Queue()
+            self._pending = {}
+            self._closing = threading.Event()
+            self._gave_up = False
+            self._segment_file = None
+            self._recover()
+            self._open_segment(0)
+            self._thread = threading.Thread(target=self._run, name="submission-writer", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            atexit.register(self.close)
+
+    def _segment_path(self, pid: int, segment: int) -> str:
+        return os.path.join(self.spool_dir, f"submissions-{pid}-{segment:06d}.jsonl")
+
+    def _open_segment(self, segment: int):
+        if self._segment_file is not None:
+            self._segment_file.close()
+        self._segment = segment
+        self._segment_count = 0
+        self._segment_file = open(self._segment_path(os.getpid(), segment), "a", encoding="utf-8")
+
+    def _drop_segments_before(self, segment: int):
+        for old in range(segment - 1, -1, -1):
+            path = self._segment_path(os.getpid(), old)
+            if not os.path.exists(path):
+                break
+            os.remove(path)
+
+    def _recover(self):
+        """Replay spool files left behind by writers that are no longer running"""
+        own_pid = str(os.getpid())
+        pids = set()
+        for path in glob.glob(os.path.join(self.spool_dir, "writer-*.lock")):
+            pids.add(os.path.basename(path)[len("writer-"):-len(".lock")])
+        for path in glob.glob(os.path.join(self.spool_dir, "submissions-*.jsonl")):
+            pids.add(os.path.basename(path).split("-")[1])
+
+        for pid in pids:
+            lock_path = os.path.join(self.spool_dir, f"writer-{pid}.lock")
+            lock_file = None
+            # Files under our own pid were left by an earlier process that had the same pid
+            if pid != own_pid:
+                lock_file = open(lock_path, "a")
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    lock_file.close()
+                    continue  # Still owned by a live worker
+            try:
+                self._replay(pid)
+                if lock_file is not None:
+                    os.remove(lock_path)
+            finally:
+                if lock_file is not None:
+                    lock_file.close()
+
+    def _replay(self, pid: str):
+        paths = sorted(glob.glob(os.path.join(self.spool_dir, f"submissions-{pid}-*.jsonl")))
+        rows = []
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                # A torn last line means that request never got its response
+                for line in f:
+                    try:
+                        rows.append(_from_spool(line))
+                    except ValueError:
+                        continue
+        if rows:
+            with self.app.app_context():
+                for start in range(0, len(rows), RECOVERY_CHUNK):
+                    self._write(rows[start:start + RECOVERY_CHUNK], skip_existing=True)
+                db.session.remove()
+            self.app.logger.info(f"Recovered {len(rows)} spooled submissions from worker {pid}")
+        for path in paths:
+            os.remove(path)
+
+    def _run(self):
+        with self.app.app_context():
+            stopping = False
+            while not stopping:
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+                batch = [item]
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_batch:
+                    try:
+                        item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                if not self._commit_batch(batch):
+                    return
+
+            with self._spool_lock:
+                if self._drained():
+                    self._segment_file.close()
+                    self._segment_file = None
+                    self._drop_segments_before(self._segment + 1)
+
+    def _commit_batch(self, batch) -> bool:
+        """Commit a batch, retrying until it succeeds; False if the writer closed first"""
+        rows = [row for _, row in batch]
+        attempt = 0
+        while True:
+            try:
+                # A commit that raised may still have gone through, so retries skip rows already stored
+                self._write(rows, skip_existing=attempt > 0)
+                break
+            except Exception as e:
+                db.session.rollback()
+                db.session.remove()
+                attempt += 1
+                self._gave_up = True
+                self.app.logger.error(f"Error writing {len(rows)} submissions (attempt {attempt}): {str(e)}")
+            if self._closing.wait(min(MAX_RETRY_DELAY, 0.1 * 2 ** min(attempt - 1, 10))):
+                # The rows stay pending and spooled; the next writer to start replays them
+                self.app.logger.error(f"Leaving {len(rows)} uncommitted submissions to the next writer")
+                return False
+        self._gave_up = False
+        db.session.remove()
+
+        with self._idle:
+            for row in rows:
+                self._pending.pop(row["id"], None)
+            self._idle.notify_all()
+        # Rows are committed in queue order, so earlier segments are fully written
+        with self._spool_lock:
+            self._drop_segments_before(batch[-1][0])
+        return True
+
+    def _write(self, rows: List[Dict[str, Any]], skip_existing: bool = False):
+        """Insert rows and count them in the analytics rollups in one transaction"""
+        if skip_existing:
+            ids = [row["id"] for row in rows]
+            existing = set(db.session.scalars(select(Submission.id).where(Submission.id.in_(ids))))
+            rows = [row for row in rows if row["id"] not in existing]
+            if not rows:
+                return
+        db.session.execute(insert(Submission), rows)
+        analytics.record_submissions(rows)
+        db.session.commit()
@@ -1,18 +1,239 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify
-from app import app, db
-from models import Submission, Feedback
-from diagnostic_engine import DiagnosticEngine
+from flask import render_template, request, redirect, url_for, flash, jsonify, Response, abort, stream_with_context, session, send_from_directory
+from sqlalchemy import insert, func, select, or_, and_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from datetime import datetime, timedelta, timezone
+from app import app, db, reads_from_replica
+from models import Submission, Feedback, encode_submission, upsert_feedback
+from diagnostic_engine import DiagnosticEngine, NEXT_QUESTIONS
+import analytics
+import bayes
+import export
+from persistence import SubmissionWriter, submission_row
+from instrumentation import instrumentation
+from surveillance import SurveillanceWindow
+from page_cache import CachedBody, ResponseCache, cached_response
 import json
+import math
+import os
 
 # Initialize diagnostic engine
-diagnostic_engine = DiagnosticEngine()
+diagnostic_engine = DiagnosticEngine(
+    knowledge_base_path=os.environ.get("KNOWLEDGE_BASE_PATH"),
+    cache_size=int(os.environ.get("DIAGNOSIS_CACHE_SIZE", "1024")),
+    reload_interval=float(os.environ.get("KNOWLEDGE_BASE_RELOAD_INTERVAL", "30")),
+    fuzzy_matching=os.environ.get("FUZZY_MATCHING", "1") == "1",
+)
+
+# Scoring mode for this deployment: "rules" (fixed symptom weights) or "bayes" (learned from feedback).
+# Likelihood counts are kept up to date in either mode; rules stay the fallback until a model is loaded.
+SCORING_MODE = os.environ.get("SCORING_MODE", "rules")
+likelihood_trainer = bayes.NaiveBayesTrainer(
+    diagnostic_engine,
+    active=SCORING_MODE == "bayes",
+    refresh_interval=float(os.environ.get("BAYES_REFRESH_INTERVAL", "60")),
+)
+
+# Outbreak surveillance: hourly counts per location and top condition, compared with earlier windows
+surveillance_window = SurveillanceWindow(
+    window_hours=int(os.environ.get("SURVEILLANCE_WINDOW_HOURS", "24")),
+    baseline_windows=int(os.environ.get("SURVEILLANCE_BASELINE_WINDOWS", "14")),
+    refresh_interval=float(os.environ.get("SURVEILLANCE_REFRESH_INTERVAL", "60")),
+)
+
+# Write-behind persistence of submissions, group-committed from a background thread
+submission_writer = SubmissionWriter(
+    app,
+    spool_dir=os.environ.get("SUBMISSION_SPOOL_DIR", os.path.join(app.instance_path, "spool")),
+    enabled=os.environ.get("SUBMISSION_WRITE_BEHIND", "1") == "1",
+)
+
+# Stage timings, SQL counts and /metrics; PROFILE_REQUESTS=1 lets an X-Profile header cProfile a request
+instrumentation.init_app(
+    app,
+    enabled=os.environ.get("METRICS_ENABLED", "1") == "1",
+    profile=os.environ.get("PROFILE_REQUESTS", "0") == "1",
+)
+span = instrumentation.span
+
+
+@instrumentation.register_collector
+def engine_metrics():
+    cache = diagnostic_engine.cache_info()
+    yield "# TYPE ghanadiag_diagnosis_cache_hits_total counter"
+    yield f"ghanadiag_diagnosis_cache_hits_total {cache['hits']}"
+    yield "# TYPE ghanadiag_diagnosis_cache_misses_total counter"
+    yield f"ghanadiag_diagnosis_cache_misses_total {cache['misses']}"
+    yield "# TYPE ghanadiag_diagnosis_cache_evictions_total counter"
+    yield f"ghanadiag_diagnosis_cache_evictions_total {cache['evictions']}"
+    yield "# TYPE ghanadiag_diagnosis_cache_size gauge"
+    yield f"ghanadiag_diagnosis_cache_size {cache['size']}"
+    yield "# TYPE ghanadiag_pending_submissions gauge"
+    yield f"ghanadiag_pending_submissions {submission_writer.pending_count()}"
+    yield "# TYPE ghanadiag_surveillance_series gauge"
+    yield f"ghanadiag_surveillance_series {surveillance_window.series_count()}"
+    yield "# TYPE ghanadiag_db_connections_checked_out gauge"
+    for bind, engine in db.engines.items():
+        checkedout = getattr(engine.pool, "checkedout", None)
+        if checkedout is not None:
+            yield f'ghanadiag_db_connections_checked_out{{bind="{bind or "primary"}"}} {checkedout()}'
+
+# Pages and bundle JSON rendered once per knowledge base version
+response_cache = ResponseCache()
+# The symptom picker revalidates on every visit (a 304 is tiny); bundles can be reused for a while
+INDEX_CACHE_CONTROL = 'public, no-cache'
+BUNDLE_CACHE_CONTROL = f'public, max-age={int(os.environ.get("BUNDLE_MAX_AGE", "300"))}'
+
+# Largest number of records accepted by a single batch diagnosis request
+MAX_BATCH_SIZE = 10000
+
+# Largest client ID accepted from an offline client, matching Submission.client_id
+MAX_CLIENT_ID_LENGTH = 64
+
+# Free-text intake fields and the most characters their Submission columns hold
+TEXT_FIELD_LENGTHS = {field: Submission.__table__.c[field].type.length for field in ('name', 'gender', 'location')}
+
+# Most follow-up questions a single /api/next-questions request can ask for
+MAX_NEXT_QUESTIONS = 20
+
+# Submissions shown per history page
+HISTORY_PAGE_SIZE = 20
+
+
+def parse_age(age):
+    """Convert a submitted age to an int, or None if missing or out of range"""
+    if age is None or not str(age).strip():
+        return None
+    try:
+        age_int = int(age)
+    except (TypeError, ValueError):
+        return None
+    if age_int < 0 or age_int > 150:
+        return None
+    return age_int
+
+
+def record_error(record):
+    """Why an intake record is malformed, or None"""
+    if not isinstance(record, dict):
+        return 'must be an object'
+    symptoms = record.get('symptoms') or []
+    if not isinstance(symptoms, list) or not all(isinstance(s, str) for s in symptoms):
+        return '"symptoms" must be a list of strings'
+    symptoms_text = record.get('symptoms_text')
+    if symptoms_text is not None and not isinstance(symptoms_text, str):
+        return '"symptoms_text" must be a string'
+    if not symptoms and not (symptoms_text or '').strip():
+        return 'no symptoms provided'
+    for field, length in TEXT_FIELD_LENGTHS.items():
+        value = record.get(field)
+        if value is not None and (not isinstance(value, str) or len(value.strip()) > length):
+            return f'"{field}" must be a string of at most {length} characters'
+    return None
+
+
+def validate_records(records):
+    """Error message for the first malformed intake record, or None"""
+    for i, record in enumerate(records):
+        error = record_error(record)
+        if error:
+            return f'Record {i}: {error}'
+    return None
+
+
+def sync_record_error(record):
+    """Why an offline record can never be stored, or None"""
+    error = record_error(record)
+    if error:
+        return error
+    client_id = record.get('client_id')
+    if not isinstance(client_id, str) or not client_id or len(client_id) > MAX_CLIENT_ID_LENGTH:
+        return f'"client_id" must be a string of 1 to {MAX_CLIENT_ID_LENGTH} characters'
+    return None
+
+
+def intake_row(submission_id, record, diagnosis_result, kb, created_at):
+    """Submission column values for an intake record diagnosed against kb"""
+    name = (record.get('name') or '').strip()
+    gender = (record.get('gender') or '').strip()
+    location = (record.get('location') or '').strip()
+    symptoms_text = (record.get('symptoms_text') or '').strip()
+    return {
+        'id': submission_id,
+        'name': name or None,
+        'age': parse_age(record.get('age')),
+        'gender': gender or None,
+        'location': location or None,
+        'symptoms_text': symptoms_text or None,
+        'created_at': created_at,
+        **encode_submission(kb, record.get('symptoms') or [], diagnosis_result),
+    }
+
+
+def parse_client_time(value, now):
+    """A client's ISO timestamp as naive UTC, clamped to now; None if missing or malformed"""
+    if not isinstance(value, str):
+        return None
+    try:
+        moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(moment, now)
+
+
+@app.before_request
+def reload_knowledge_base():
+    """Pick up a new knowledge base version or likelihood counts without restarting the worker"""
+    try:
+        if diagnostic_engine.reload_if_changed():
+            app.logger.info(f"Loaded knowledge base version {diagnostic_engine.kb.version}")
+    except Exception as e:
+        # Keep serving the previous version if the new file is broken
+        app.logger.error(f"Error reloading knowledge base: {str(e)}")
+    try:
+        likelihood_trainer.refresh_if_due()
+    except Exception as e:
+        # The previous model, or the rule engine if there is none, keeps scoring
+        db.session.rollback()
+        app.logger.error(f"Error refreshing the naive-Bayes model: {str(e)}")
+    try:
+        surveillance_window.refresh_if_due()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error syncing surveillance counts: {str(e)}")
+
+
+def encode_cursor(submission):
+    """Build a history cursor pointing just past the given submission"""
+    return f"{submission.created_at.isoformat()}_{submission.id}"
+
+
+def decode_cursor(cursor):
+    """Parse a history cursor into (created_at, id), or None if it is malformed"""
+    try:
+        created_at, submission_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(submission_id)
+    except (AttributeError, ValueError):
+        return None
 
 @app.route('/')
 def index():
     """Main page with symptom input form"""
-    symptoms = diagnostic_engine.get_all_symptoms()
-    example_bundles = diagnostic_engine.get_example_symptom_bundles()
-    return render_template('index.html', symptoms=symptoms, example_bundles=example_bundles)
+    kb = diagnostic_engine.kb
+    if session.get('_flashes'):
+        # Flash messages make this one response personal, so render it fresh
+        response = Response(render_index(kb))
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    cached = response_cache.get(kb.storage_key, 'index',
+                                lambda: CachedBody(render_index(kb).encode('utf-8'), 'text/html'))
+    return cached_response(cached, diagnostic_engine.last_modified, INDEX_CACHE_CONTROL)
+
+
+def render_index(kb):
+    return render_template('index.html', symptoms=list(kb.symptoms), example_bundles=kb.example_bundles)
 
 @app.route('/diagnose', methods=['POST'])
 def diagnose():
@@ -32,103 +253,403 @@ def diagnose():
         if not selected_symptoms and not symptoms_text:
             flash('Please select symptoms or describe how you feel.', 'error')
             return redirect(url_for('index'))
+        for field, value in (('name', name), ('gender', gender or ''), ('location', location)):
+            if len(value) > TEXT_FIELD_LENGTHS[field]:
+                flash(f'{field.capitalize()} must be at most {TEXT_FIELD_LENGTHS[field]} characters.', 'error')
+                return redirect(url_for('index'))
         
         # Process age
-        age_int = None
-        if age and age.strip():
-            try:
-                age_int = int(age)
-                if age_int < 0 or age_int > 150:
-                    age_int = None
-            except ValueError:
-                age_int = None
+        age_int = parse_age(age)
         
-        # Get diagnosis from engine
-        diagnosis_result = diagnostic_engine.diagnose(selected_symptoms, symptoms_text)
+        # Get diagnosis from engine, normalizing free text first so each stage is timed.
+        # One knowledge base for scoring and encoding, even if a reload lands in between
+        kb = diagnostic_engine.kb
+        with span('normalize'):
+            text_symptoms = diagnostic_engine.normalize_symptoms(symptoms_text, kb)
+        with span('score'):
+            diagnosis_result = diagnostic_engine.diagnose(selected_symptoms + text_symptoms, kb=kb)
         
-        # Save to database
+        # Queue for saving; the id is assigned up front so the page can link to it
         submission = Submission(
+            id=submission_writer.ids.allocate(),
             name=name if name else None,
             age=age_int,
             gender=gender if gender else None,
             location=location if location else None,
-            symptoms_selected=selected_symptoms,
             symptoms_text=symptoms_text if symptoms_text else None,
-            diagnosis=diagnosis_result
+            created_at=datetime.utcnow(),
+            **encode_submission(kb, selected_symptoms, diagnosis_result)
         )
         
-        db.session.add(submission)
-        db.session.commit()
+        with span('persist'):
+            submission_writer.submit(submission_row(submission))
+        surveillance_window.observe(submission.location, analytics.top_condition(diagnosis_result),
+                                    submission.created_at)
         
-        return render_template('diagnosis.html', 
-                             diagnosis=diagnosis_result, 
-                             submission=submission)
+        with span('render'):
+            return render_template('diagnosis.html', 
+                                 diagnosis=diagnosis_result, 
+                                 submission=submission)
     
     except Exception as e:
+        db.session.rollback()
         app.logger.error(f"Error in diagnosis: {str(e)}")
         flash('An error occurred while processing your symptoms. Please try again.', 'error')
         return redirect(url_for('index'))
 
+@app.route('/api/diagnose/batch', methods=['POST'])
+def diagnose_batch():
+    """Diagnose a batch of intake records and store them in one transaction"""
+    payload = request.get_json(silent=True)
+    records = payload.get('records') if isinstance(payload, dict) else None
+    if not isinstance(records, list) or not records:
+        return jsonify({'error': 'Expected a JSON object with a non-empty "records" list'}), 400
+    if len(records) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_BATCH_SIZE} records are accepted per batch'}), 413
+
+    error = validate_records(records)
+    if error:
+        return jsonify({'error': error}), 400
+
+    try:
+        # Results are encoded against the same knowledge base they were scored with
+        kb = diagnostic_engine.kb
+        results = diagnostic_engine.diagnose_many(records, kb)
+
+        now = datetime.utcnow()
+        submission_ids = submission_writer.ids.allocate_many(len(records))
+        rows = [intake_row(submission_id, record, diagnosis_result, kb, now)
+                for submission_id, record, diagnosis_result in zip(submission_ids, records, results)]
+
+        # One multi-row INSERT in a single transaction instead of a commit per record
+        db.session.execute(insert(Submission), rows)
+        analytics.record_submissions(rows)
+        db.session.commit()
+        for row, diagnosis_result in zip(rows, results):
+            surveillance_window.observe(row['location'], analytics.top_condition(diagnosis_result), now)
+
+        return jsonify({'results': [
+            {'submission_id': submission_id, 'diagnosis': diagnosis_result}
+            for submission_id, diagnosis_result in zip(submission_ids, results)
+        ]})
+
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error(f"Error in batch diagnosis: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/next-questions', methods=['POST'])
+def next_questions():
+    """Rank the symptoms worth asking about next, by expected information gain over the top diagnoses"""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    symptoms = payload.get('symptoms') or []
+    absent = payload.get('absent_symptoms') or []
+    for field, value in (('symptoms', symptoms), ('absent_symptoms', absent)):
+        if not isinstance(value, list) or not all(isinstance(s, str) for s in value):
+            return jsonify({'error': f'"{field}" must be a list of strings'}), 400
+    symptoms_text = payload.get('symptoms_text') or ''
+    if not isinstance(symptoms_text, str):
+        return jsonify({'error': '"symptoms_text" must be a string'}), 400
+    if not symptoms and not symptoms_text.strip():
+        return jsonify({'error': 'No symptoms provided'}), 400
+    limit = payload.get('limit', NEXT_QUESTIONS)
+    if not isinstance(limit, int) or isinstance(limit, bool) or not 1 <= limit <= MAX_NEXT_QUESTIONS:
+        return jsonify({'error': f'"limit" must be an integer from 1 to {MAX_NEXT_QUESTIONS}'}), 400
+
+    try:
+        with span('score'):
+            result = diagnostic_engine.next_questions(symptoms, symptoms_text, absent, limit)
+        return jsonify({
+            'processed_symptoms': result.get('processed_symptoms', []),
+            'diagnoses': [{'condition': d['condition'], 'confidence': d['confidence']}
+                          for d in result['diagnoses']],
+            'next_questions': result['next_questions'],
+        })
+    except Exception as e:
+        app.logger.error(f"Error suggesting next questions: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/knowledge-base')
+def knowledge_base_export():
+    """Compact export of the knowledge base for diagnosing in the browser"""
+    kb = diagnostic_engine.kb
+    cached = response_cache.get(kb.storage_key, 'knowledge-base', lambda: CachedBody(
+        app.json.dumps(kb.client_export(diagnostic_engine.fuzzy_matching, SCORING_MODE)).encode('utf-8') + b'\n',
+        'application/json'))
+    return cached_response(cached, diagnostic_engine.last_modified, INDEX_CACHE_CONTROL)
+
+@app.route('/sw.js')
+def service_worker():
+    """Service worker, served from the root so it can control every page"""
+    response = send_from_directory(app.static_folder, 'js/sw.js', mimetype='application/javascript')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/sync', methods=['POST'])
+def sync_submissions():
+    """Store assessments made offline; one result per record, in order.
+
+    Records already synced are reported as duplicates. Malformed records are
+    reported as rejected, with the reason, while the rest of the batch is
+    stored, so the client can drop them instead of retrying forever.
+    """
+    payload = request.get_json(silent=True)
+    records = payload.get('records') if isinstance(payload, dict) else None
+    if not isinstance(records, list) or not records:
+        return jsonify({'error': 'Expected a JSON object with a non-empty "records" list'}), 400
+    if len(records) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_BATCH_SIZE} records are accepted per batch'}), 413
+
+    results = [None] * len(records)
+    valid = []
+    for i, record in enumerate(records):
+        error = sync_record_error(record)
+        if error is None:
+            valid.append(i)
+            continue
+        client_id = record.get('client_id') if isinstance(record, dict) else None
+        results[i] = {'client_id': client_id if isinstance(client_id, str) else None,
+                      'status': 'rejected', 'error': error}
+
+    # A concurrent sync of the same records trips the unique index; the retry then sees them as duplicates
+    for attempt in range(2):
+        try:
+            if valid:
+                for i, result in zip(valid, store_synced([records[i] for i in valid])):
+                    results[i] = result
+            return jsonify({'results': results})
+        except IntegrityError:
+            db.session.rollback()
+            if attempt:
+                app.logger.error("Sync failed twice on duplicate client IDs")
+                return jsonify({'error': 'Conflicting sync in progress, please retry'}), 409
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Error in sync: {str(e)}")
+            return jsonify({'error': 'Internal server error'}), 500
+
+
+def store_synced(records):
+    """Diagnose and insert the records not stored yet; one result per record, in order"""
+    client_ids = {record['client_id'] for record in records}
+    stored = dict(db.session.execute(
+        select(Submission.client_id, Submission.id).where(Submission.client_id.in_(client_ids))
+    ).all())
+
+    # Re-diagnosed here so the stored result reflects this server's knowledge base and scoring mode
+    new_records = {}
+    for record in records:
+        if record['client_id'] not in stored:
+            new_records.setdefault(record['client_id'], record)
+    created = {}
+    if new_records:
+        pending = list(new_records.values())
+        kb = diagnostic_engine.kb
+        results = diagnostic_engine.diagnose_many(pending, kb)
+        now = datetime.utcnow()
+        submission_ids = submission_writer.ids.allocate_many(len(pending))
+        rows = [dict(intake_row(submission_id, record, diagnosis_result, kb,
+                                parse_client_time(record.get('created_at'), now) or now),
+                     client_id=record['client_id'])
+                for submission_id, record, diagnosis_result in zip(submission_ids, pending, results)]
+        db.session.execute(insert(Submission), rows)
+        analytics.record_submissions(rows)
+        db.session.commit()
+        for row, diagnosis_result in zip(rows, results):
+            surveillance_window.observe(row['location'], analytics.top_condition(diagnosis_result),
+                                        row['created_at'])
+            created[row['client_id']] = row['id']
+
+    results = []
+    for record in records:
+        client_id = record['client_id']
+        if client_id in created:
+            # Later repeats of the ID in this batch then count as duplicates of this one
+            stored[client_id] = created.pop(client_id)
+            status = 'created'
+        else:
+            status = 'duplicate'
+        results.append({'client_id': client_id, 'submission_id': stored[client_id], 'status': status})
+    return results
+
 @app.route('/feedback/<int:submission_id>', methods=['GET', 'POST'])
 def feedback(submission_id):
     """Handle feedback submission"""
-    submission = Submission.query.get_or_404(submission_id)
+    if submission_writer.is_pending(submission_id):
+        # Feedback can arrive before the write-behind queue has saved the submission
+        submission_writer.flush(timeout=5)
+    with span('query'):
+        submission = Submission.query.get_or_404(submission_id)
     
     if request.method == 'POST':
         try:
             is_accurate = request.form.get('is_accurate') == 'yes'
             comments = request.form.get('comments', '').strip()
             
-            # Check if feedback already exists
-            existing_feedback = Feedback.query.filter_by(submission_id=submission_id).first()
+            with span('query'):
+                previous = upsert_feedback(submission_id, is_accurate, comments if comments else None)
+            analytics.record_feedback(submission, is_accurate, previous=previous)
+            likelihood_trainer.record_feedback(submission, is_accurate, previous=previous)
             
-            if existing_feedback:
-                # Update existing feedback
-                existing_feedback.is_accurate = is_accurate
-                existing_feedback.comments = comments if comments else None
-            else:
-                # Create new feedback
-                feedback_obj = Feedback(
-                    submission_id=submission_id,
-                    is_accurate=is_accurate,
-                    comments=comments if comments else None
-                )
-                db.session.add(feedback_obj)
-            
-            db.session.commit()
+            with span('commit'):
+                db.session.commit()
             flash('Thank you for your feedback! It helps us improve our diagnostic accuracy.', 'success')
             return redirect(url_for('history'))
             
         except Exception as e:
+            db.session.rollback()
             app.logger.error(f"Error saving feedback: {str(e)}")
             flash('An error occurred while saving your feedback. Please try again.', 'error')
     
-    return render_template('feedback.html', submission=submission)
+    with span('render'):
+        return render_template('feedback.html', submission=submission)
 
 @app.route('/history')
+@reads_from_replica
 def history():
-    """Display user submission history"""
+    """Display user submission history, one keyset-paginated page at a time"""
     try:
-        # Get all submissions ordered by most recent first
-        submissions = Submission.query.order_by(Submission.created_at.desc()).all()
-        return render_template('history.html', submissions=submissions)
+        query = (Submission.query
+                 .options(selectinload(Submission.feedback))
+                 .order_by(Submission.created_at.desc(), Submission.id.desc()))
+
+        cursor = decode_cursor(request.args.get('cursor'))
+        if cursor:
+            created_at, submission_id = cursor
+            query = query.filter(or_(
+                Submission.created_at < created_at,
+                and_(Submission.created_at == created_at, Submission.id < submission_id)
+            ))
+
+        # Fetch one extra row to know whether an older page exists
+        with span('query'):
+            submissions = query.limit(HISTORY_PAGE_SIZE + 1).all()
+        next_cursor = None
+        if len(submissions) > HISTORY_PAGE_SIZE:
+            submissions = submissions[:HISTORY_PAGE_SIZE]
+            next_cursor = encode_cursor(submissions[-1])
+
+        with span('stats'):
+            stats = history_stats()
+        with span('render'):
+            return render_template('history.html', submissions=submissions, stats=stats,
+                                   next_cursor=next_cursor, is_first_page=cursor is None)
     
     except Exception as e:
         app.logger.error(f"Error loading history: {str(e)}")
         flash('An error occurred while loading the history.', 'error')
-        return render_template('history.html', submissions=[])
+        return render_template('history.html', submissions=[],
+                               stats={'total': 0, 'with_feedback': 0, 'recent': 0},
+                               next_cursor=None, is_first_page=True)
+
+
+def history_stats():
+    """Summary counts for the history page, computed with SQL aggregates"""
+    week_ago = datetime.utcnow() - timedelta(days=7)
+    total, recent = db.session.execute(
+        select(func.count(Submission.id),
+               func.count(Submission.id).filter(Submission.created_at >= week_ago))
+    ).one()
+    with_feedback = db.session.scalar(select(func.count(Feedback.id)))
+    return {'total': total, 'with_feedback': with_feedback, 'recent': recent}
+
+@app.route('/api/stats')
+@reads_from_replica
+def stats():
+    """API endpoint for diagnosis accuracy, read from the analytics rollups only"""
+    group_by = [name for name in request.args.get('group_by', 'condition').split(',') if name]
+    unknown = [name for name in group_by if name not in analytics.GROUP_BY_COLUMNS]
+    if unknown:
+        return jsonify({'error': f'Cannot group by: {", ".join(unknown)}'}), 400
+
+    filters = {name: request.args.get(name) for name in ('condition', 'location', 'age_band')}
+    try:
+        for name in ('since', 'until'):
+            value = request.args.get(name)
+            filters[name] = datetime.fromisoformat(value) if value else None
+    except ValueError:
+        return jsonify({'error': 'since and until must be ISO dates'}), 400
+
+    try:
+        return jsonify({'group_by': group_by, 'stats': analytics.get_stats(group_by, filters)})
+    except Exception as e:
+        app.logger.error(f"Error loading stats: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/api/export')
+@reads_from_replica
+def export_submissions():
+    """Stream submissions joined with feedback as CSV or NDJSON, optionally gzipped"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        return jsonify({'error': f'format must be one of: {", ".join(sorted(export.FORMATS))}'}), 400
+    compress = request.args.get('gzip') == '1'
+
+    filters = {name: request.args.get(name) for name in ('location', 'condition')}
+    try:
+        for name in ('since', 'until'):
+            value = request.args.get(name)
+            filters[name] = datetime.fromisoformat(value) if value else None
+        # Clients resume an interrupted export from the last submission_id they received
+        after = int(request.args.get('after', 0))
+    except ValueError:
+        return jsonify({'error': 'since and until must be ISO dates and after a submission id'}), 400
+
+    chunks = export.export_chunks(fmt, filters, after, compress)
+    headers = {'Content-Disposition': f'attachment; filename="{export.filename(fmt, compress)}"'}
+    mimetype = 'application/gzip' if compress else export.FORMATS[fmt]
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+@app.route('/api/surveillance')
+def surveillance():
+    """API endpoint listing current outbreak hotspots from the in-memory surveillance window"""
+    try:
+        threshold = float(request.args.get('threshold', 3.0))
+        min_count = int(request.args.get('min_count', 5))
+    except ValueError:
+        return jsonify({'error': 'threshold must be a number and min_count an integer'}), 400
+    # nan compares false with every score and inf can never be exceeded; neither is a usable threshold
+    if not math.isfinite(threshold):
+        return jsonify({'error': 'threshold must be a finite number'}), 400
+
+    try:
+        hotspots = surveillance_window.hotspots(threshold=threshold, min_count=min_count,
+                                                condition=request.args.get('condition'),
+                                                location=request.args.get('location'))
+        return jsonify({
+            'window_hours': surveillance_window.window_hours,
+            'baseline_windows': surveillance_window.baseline_windows,
+            'threshold': threshold,
+            'baseline_complete': surveillance_window.has_baseline(),
+            'hotspots': hotspots,
+        })
+    except Exception as e:
+        app.logger.error(f"Error computing hotspots: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of this worker's metrics"""
+    if not instrumentation.enabled:
+        abort(404)
+    return Response(instrumentation.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/example-symptoms/<bundle_name>')
 def get_example_symptoms(bundle_name):
     """API endpoint to get example symptoms for a bundle"""
     try:
-        bundles = diagnostic_engine.get_example_symptom_bundles()
-        bundle = next((b for b in bundles if b['name'].lower().replace(' ', '-') == bundle_name.lower()), None)
-        
-        if bundle:
-            return jsonify({'symptoms': bundle['symptoms']})
-        else:
+        kb = diagnostic_engine.kb
+        bundle = kb.bundles_by_slug.get(bundle_name.lower())
+        if not bundle:
             return jsonify({'error': 'Bundle not found'}), 404
+
+        cached = response_cache.get(
+            kb.storage_key, f'bundle:{bundle_name.lower()}',
+            lambda: CachedBody(app.json.dumps({'symptoms': bundle['symptoms']}).encode('utf-8') + b'\n',
+                               'application/json'))
+        return cached_response(cached, diagnostic_engine.last_modified, BUNDLE_CACHE_CONTROL)
             
     except Exception as e:
         app.logger.error(f"Error getting example symptoms: {str(e)}")
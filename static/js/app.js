@@ -363,6 +363,323 @@ class LoadingManager {
     }
 }
 
+// Assessments queued on this device until /api/sync accepts them
+class SyncQueue {
+    constructor() {
+        this.key = 'ads-sync-queue';
+        this.batchSize = 100;
+        this.flushing = false;
+        this.listeners = [];
+    }
+
+    pending() {
+        try {
+            return JSON.parse(localStorage.getItem(this.key)) || [];
+        } catch (e) {
+            return [];
+        }
+    }
+
+    save(records) {
+        localStorage.setItem(this.key, JSON.stringify(records));
+    }
+
+    add(record) {
+        this.save([...this.pending(), record]);
+    }
+
+    onSynced(listener) {
+        this.listeners.push(listener);
+    }
+
+    async flush() {
+        if (this.flushing || !navigator.onLine) {
+            return;
+        }
+        this.flushing = true;
+        try {
+            let batch = this.pending().slice(0, this.batchSize);
+            while (batch.length > 0) {
+                const response = await fetch('/api/sync', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ records: batch }),
+                });
+                if (!response.ok) {
+                    console.warn(`Sync failed with status ${response.status}`);
+                    break;
+                }
+                const { results } = await response.json();
+                // Every record gets a result: created and duplicate mean the server has it,
+                // rejected that it never will, so none of the batch is sent again
+                const sent = new Set(batch.map(record => JSON.stringify(record)));
+                this.save(this.pending().filter(record => !sent.has(JSON.stringify(record))));
+                results.forEach(result => {
+                    if (result.status === 'rejected') {
+                        console.warn(`Sync rejected record ${result.client_id}: ${result.error}`);
+                    }
+                    this.listeners.forEach(listener => listener(result));
+                });
+                batch = this.pending().slice(0, this.batchSize);
+            }
+        } catch (e) {
+            console.log('Sync deferred until the connection returns:', e);
+        } finally {
+            this.flushing = false;
+        }
+    }
+}
+
+// Diagnoses assessments in the browser, so results don't wait on the network
+class OfflineAssessment {
+    constructor(syncQueue) {
+        this.syncQueue = syncQueue;
+        this.cacheKey = 'ads-knowledge-base';
+        this.engine = null;
+        this.form = document.getElementById('assessment-form');
+        this.init();
+    }
+
+    init() {
+        if (!this.form || typeof LocalDiagnosticEngine === 'undefined') {
+            return;
+        }
+        this.loadKnowledgeBase();
+        // Registered after the validation and loading handlers, so it sees their outcome
+        this.form.addEventListener('submit', (e) => {
+            if (e.defaultPrevented || !this.engine) {
+                return;
+            }
+            // The browser only has the fixed weights; a server scoring with a learned model
+            // diagnoses while it can be reached, so the patient sees the result that is stored
+            if (this.engine.scoringMode !== 'rules' && navigator.onLine) {
+                return;
+            }
+            e.preventDefault();
+            this.assess();
+        });
+    }
+
+    async loadKnowledgeBase() {
+        let knowledgeBase = null;
+        try {
+            const response = await fetch('/api/knowledge-base');
+            if (response.ok) {
+                const body = await response.text();
+                knowledgeBase = JSON.parse(body);
+                localStorage.setItem(this.cacheKey, body);
+            }
+        } catch (e) {
+            console.log('Knowledge base unavailable, using the saved copy');
+        }
+        if (!knowledgeBase) {
+            try {
+                knowledgeBase = JSON.parse(localStorage.getItem(this.cacheKey));
+            } catch (e) {
+                knowledgeBase = null;
+            }
+        }
+        // Without a knowledge base the form posts to the server as usual
+        if (knowledgeBase) {
+            this.engine = new LocalDiagnosticEngine(knowledgeBase);
+        }
+    }
+
+    newClientId() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}-${Math.random().toString(36).slice(2)}`;
+    }
+
+    assess() {
+        const data = new FormData(this.form);
+        const record = {
+            client_id: this.newClientId(),
+            name: (data.get('name') || '').trim(),
+            age: data.get('age') || null,
+            gender: data.get('gender') || null,
+            location: (data.get('location') || '').trim(),
+            symptoms: data.getAll('symptoms'),
+            symptoms_text: (data.get('symptoms_text') || '').trim(),
+            created_at: new Date().toISOString(),
+        };
+        const diagnosis = this.engine.diagnose(record.symptoms, record.symptoms_text);
+
+        this.syncQueue.add(record);
+        this.renderResult(record, diagnosis);
+        if (diagnosis.diagnoses.length) {
+            this.showNextQuestions(record);
+        }
+        this.syncQueue.onSynced((result) => {
+            if (result.client_id !== record.client_id) {
+                return;
+            }
+            if (result.status === 'rejected') {
+                this.showRejected(result.error);
+            } else {
+                this.showSynced(result.submission_id);
+            }
+        });
+        this.syncQueue.flush();
+    }
+
+    renderResult(record, diagnosis) {
+        const urgencyStyles = {
+            urgent: ['bg-red-100 text-red-800 dark:bg-red-900/30 dark:text-red-300', 'alert-triangle', 'Urgent - See doctor immediately'],
+            high: ['bg-orange-100 text-orange-800 dark:bg-orange-900/30 dark:text-orange-300', 'alert-circle', 'High priority - See doctor soon'],
+            medium: ['bg-yellow-100 text-yellow-800 dark:bg-yellow-900/30 dark:text-yellow-300', 'clock', 'Medium priority - Monitor symptoms'],
+            low: ['bg-green-100 text-green-800 dark:bg-green-900/30 dark:text-green-300', 'check-circle', 'Low priority - Self-care may help'],
+        };
+        const label = code => escapeHtml(code.replace(/_/g, ' ').replace(/\b\w/g, c => c.toUpperCase()));
+
+        const conditions = diagnosis.diagnoses.map(condition => {
+            const [badgeClass, icon, badgeText] = urgencyStyles[condition.urgency] || urgencyStyles.low;
+            const matched = condition.matched_symptoms.length ? `
+                <div class="mb-4">
+                    <h4 class="font-medium text-winter-700 dark:text-winter-300 mb-2">Matching symptoms:</h4>
+                    <div class="flex flex-wrap gap-2">
+                        ${condition.matched_symptoms.map(code => `<span class="bg-green-100 dark:bg-green-900/30 text-green-800 dark:text-green-300 px-2 py-1 rounded text-sm">${label(code)}</span>`).join('')}
+                    </div>
+                </div>` : '';
+            return `
+                <div class="bg-white/60 dark:bg-winter-800/60 backdrop-blur-sm rounded-xl border border-winter-200 dark:border-winter-700 p-6">
+                    <h3 class="text-xl font-semibold text-winter-800 dark:text-winter-100 mb-2">${escapeHtml(condition.condition)}</h3>
+                    <p class="text-winter-600 dark:text-winter-400 mb-3">${escapeHtml(condition.description)}</p>
+                    <div class="mb-4">
+                        <span class="inline-flex items-center px-3 py-1 rounded-full text-sm font-medium ${badgeClass}">
+                            <i data-feather="${icon}" class="w-4 h-4 mr-1"></i>${badgeText}
+                        </span>
+                    </div>
+                    ${matched}
+                    <h4 class="font-medium text-winter-700 dark:text-winter-300 mb-3 flex items-center">
+                        <i data-feather="clipboard" class="w-4 h-4 mr-2"></i>
+                        Recommended Actions:
+                    </h4>
+                    <ul class="space-y-2">
+                        ${condition.recommendations.map(recommendation => `
+                        <li class="flex items-start">
+                            <i data-feather="chevron-right" class="w-4 h-4 text-ice-600 mr-2 mt-0.5 flex-shrink-0"></i>
+                            <span class="text-winter-600 dark:text-winter-400">${escapeHtml(recommendation)}</span>
+                        </li>`).join('')}
+                    </ul>
+                </div>`;
+        }).join('');
+
+        const container = this.form.parentNode;
+        container.innerHTML = `
+            <div class="text-center mb-8">
+                <h1 class="text-3xl md:text-4xl font-bold text-winter-800 dark:text-winter-100">Assessment Results</h1>
+            </div>
+            <div class="bg-white/60 dark:bg-winter-800/60 backdrop-blur-sm rounded-xl border border-winter-200 dark:border-winter-700 p-6 mb-6">
+                <h2 class="text-lg font-semibold text-winter-800 dark:text-winter-100 mb-4 flex items-center">
+                    <i data-feather="activity" class="w-5 h-5 mr-2 text-ice-600"></i>
+                    Assessment Summary
+                </h2>
+                <div class="bg-ice-50 dark:bg-ice-900/20 border border-ice-200 dark:border-ice-800 rounded-lg p-4">
+                    <p class="text-ice-800 dark:text-ice-200 font-medium">${escapeHtml(diagnosis.message)}</p>
+                </div>
+                <p id="sync-status" class="mt-4 text-sm text-winter-500 dark:text-winter-400">
+                    Saved on this device. It will be uploaded when you are back online.
+                </p>
+            </div>
+            <div class="space-y-6 mb-8">${conditions}</div>
+            ${diagnosis.diagnoses.length ? `
+            <div id="next-questions" class="bg-white/60 dark:bg-winter-800/60 backdrop-blur-sm rounded-xl border border-winter-200 dark:border-winter-700 p-6 mb-8">
+                <h2 class="text-lg font-semibold text-winter-800 dark:text-winter-100 mb-2 flex items-center">
+                    <i data-feather="help-circle" class="w-5 h-5 mr-2 text-ice-600"></i>
+                    Questions that would narrow this down
+                </h2>
+                <p class="text-winter-600 dark:text-winter-400 text-sm mb-3">Loading...</p>
+                <div class="flex flex-wrap gap-2"></div>
+            </div>` : ''}
+            <div class="bg-yellow-50 dark:bg-yellow-900/20 border border-yellow-200 dark:border-yellow-800 rounded-xl p-6 mb-8">
+                <h3 class="font-semibold text-yellow-800 dark:text-yellow-200 mb-2">Important Medical Disclaimer</h3>
+                <p class="text-yellow-700 dark:text-yellow-300 text-sm leading-relaxed">
+                    This assessment is for informational purposes only and should not replace professional medical advice.
+                    If you are experiencing severe symptoms, persistent symptoms, or are concerned about your health,
+                    please consult with a qualified healthcare provider immediately. In case of emergency, contact your local emergency services.
+                </p>
+            </div>
+            <div id="result-actions" class="flex flex-col sm:flex-row gap-4 justify-center">
+                <a href="/" class="bg-gradient-to-r from-ice-600 to-ice-700 hover:from-ice-700 hover:to-ice-800 text-white font-semibold py-3 px-6 rounded-xl shadow-lg flex items-center justify-center">
+                    <i data-feather="plus" class="w-5 h-5 mr-2"></i>
+                    New Assessment
+                </a>
+            </div>
+        `;
+        window.scrollTo(0, 0);
+        if (typeof feather !== 'undefined') {
+            feather.replace();
+        }
+    }
+
+    // Follow-up questions are only ranked on the server
+    async showNextQuestions(record) {
+        const panel = document.getElementById('next-questions');
+        if (!panel) {
+            return;
+        }
+        const note = panel.querySelector('p');
+        if (!navigator.onLine) {
+            note.textContent = 'Suggested follow-up questions need a connection. Ask your healthcare provider which other symptoms matter.';
+            return;
+        }
+        try {
+            const response = await fetch('/api/next-questions', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ symptoms: record.symptoms, symptoms_text: record.symptoms_text }),
+            });
+            if (!response.ok) {
+                throw new Error(`status ${response.status}`);
+            }
+            const { next_questions: questions } = await response.json();
+            if (!questions.length) {
+                panel.remove();
+                return;
+            }
+            note.textContent = 'Do you also have any of these? Mention them to your healthcare provider.';
+            panel.querySelector('div').innerHTML = questions.map(question =>
+                `<span class="bg-ice-100 dark:bg-ice-900/30 text-ice-800 dark:text-ice-200 px-3 py-1 rounded-full text-sm">${escapeHtml(question.display)}</span>`
+            ).join('');
+        } catch (e) {
+            note.textContent = 'Suggested follow-up questions could not be loaded. Ask your healthcare provider which other symptoms matter.';
+        }
+    }
+
+    showRejected(error) {
+        const status = document.getElementById('sync-status');
+        if (status) {
+            status.textContent = `This assessment could not be uploaded: ${error}`;
+        }
+    }
+
+    showSynced(submissionId) {
+        const status = document.getElementById('sync-status');
+        const actions = document.getElementById('result-actions');
+        if (!status || !actions) {
+            return;
+        }
+        status.textContent = 'Uploaded.';
+        actions.insertAdjacentHTML('afterbegin', `
+            <a href="/feedback/${Number(submissionId)}" class="bg-gradient-to-r from-green-600 to-green-700 hover:from-green-700 hover:to-green-800 text-white font-semibold py-3 px-6 rounded-xl shadow-lg flex items-center justify-center">
+                <i data-feather="message-circle" class="w-5 h-5 mr-2"></i>
+                Provide Feedback
+            </a>
+        `);
+        if (typeof feather !== 'undefined') {
+            feather.replace();
+        }
+    }
+}
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text == null ? '' : String(text);
+    return div.innerHTML;
+}
+
 // Performance monitoring
 class PerformanceMonitor {
     constructor() {
@@ -393,6 +710,10 @@ document.addEventListener('DOMContentLoaded', () => {
     new FormEnhancer();
     new LoadingManager();
     new PerformanceMonitor();
+    const syncQueue = new SyncQueue();
+    new OfflineAssessment(syncQueue);
+    syncQueue.flush();
+    window.addEventListener('online', () => syncQueue.flush());
     
     // Initialize Feather icons
     if (typeof feather !== 'undefined') {
@@ -0,0 +1,307 @@
+// Automated Diagnostic System - Local diagnosis
+//
+// Scores symptoms in the browser with the compact knowledge base export from
+// /api/knowledge-base, giving the same results as DiagnosticEngine.diagnose
+// in its rule-based mode, less the follow-up questions, which only the server
+// suggests. benchmarks/client_parity.py checks the two agree.
+
+(function (root) {
+    'use strict';
+
+    // Same as the engine's [^\W_]+ : runs of letters and digits, so Twi and Ga letters count
+    const WORD_RE = /[\p{L}\p{N}]+/gu;
+
+    function tokenize(text) {
+        return text.toLowerCase().match(WORD_RE) || [];
+    }
+
+    // Python's round(x, 1). Both round the exact binary value, but toFixed takes exact ties
+    // away from zero and Python takes them to even. A double can only sit exactly halfway
+    // between tenths if its fraction is .25 or .75, i.e. four times it is an odd integer.
+    function round1(value) {
+        const quarters = value * 4;
+        if (Number.isInteger(quarters) && quarters % 2 !== 0) {
+            const lower = Math.floor(value * 10);
+            return (lower % 2 === 0 ? lower : lower + 1) / 10;
+        }
+        return Number(value.toFixed(1));
+    }
+
+    // Distinct trigrams of a word given as code points, padded like fuzzy.trigrams
+    function trigrams(chars) {
+        const padded = ['^', ...chars, '$'];
+        const grams = new Set();
+        for (let i = 0; i + 3 <= padded.length; i++) {
+            grams.add(padded[i] + padded[i + 1] + padded[i + 2]);
+        }
+        return grams;
+    }
+
+    // Optimal string alignment distance, or limit + 1 once it exceeds limit; only the diagonal band is filled
+    function osaDistance(a, b, limit) {
+        const over = limit + 1;
+        if (Math.abs(a.length - b.length) > limit) {
+            return over;
+        }
+        let before = [];
+        let previous = Array.from({ length: b.length + 1 }, (_, j) => (j <= limit ? j : over));
+        for (let i = 1; i <= a.length; i++) {
+            const current = new Array(b.length + 1).fill(over);
+            if (i <= limit) {
+                current[0] = i;
+            }
+            let rowMin = current[0];
+            for (let j = Math.max(1, i - limit); j <= Math.min(b.length, i + limit); j++) {
+                let d = Math.min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] === b[j - 1] ? 0 : 1));
+                if (i > 1 && j > 1 && a[i - 1] === b[j - 2] && a[i - 2] === b[j - 1]) {
+                    d = Math.min(d, before[j - 2] + 1);
+                }
+                current[j] = Math.min(d, over);
+                rowMin = Math.min(rowMin, current[j]);
+            }
+            if (rowMin > limit) {
+                return over;
+            }
+            before = previous;
+            previous = current;
+        }
+        return previous[b.length];
+    }
+
+    // Same corrections as fuzzy.FuzzyMatcher; lengths count code points, like Python's len
+    class FuzzyMatcher {
+        constructor(vocabulary, settings) {
+            this.vocabulary = vocabulary;
+            this.minWordLength = settings.min_word_length;
+            this.maxEditDistance = settings.max_edit_distance;
+            this.minSimilarity = settings.min_similarity;
+            this.index = new Map();
+            this.lengths = new Map();
+            this.memo = new Map();
+            for (const word of vocabulary) {
+                const chars = Array.from(word);
+                if (chars.length < this.minWordLength) {
+                    continue;
+                }
+                if (!this.lengths.has(chars[0])) {
+                    this.lengths.set(chars[0], new Set());
+                }
+                this.lengths.get(chars[0]).add(chars.length);
+                trigrams(chars).forEach(gram => {
+                    const key = chars[0] + gram;
+                    if (!this.index.has(key)) {
+                        this.index.set(key, []);
+                    }
+                    this.index.get(key).push(word);
+                });
+            }
+        }
+
+        distanceLimit(length) {
+            let limit = 0;
+            while (limit < this.maxEditDistance && 1 - (limit + 1) / (length + limit + 1) >= this.minSimilarity) {
+                limit++;
+            }
+            return limit;
+        }
+
+        correct(word) {
+            const chars = Array.from(word);
+            if (this.vocabulary.has(word) || chars.length < this.minWordLength) {
+                return word;
+            }
+            if (!this.memo.has(word)) {
+                this.memo.set(word, this.closest(word, chars));
+            }
+            return this.memo.get(word);
+        }
+
+        closest(word, chars) {
+            const length = chars.length;
+            const limit = this.distanceLimit(length);
+            const first = chars[0];
+            const lengths = Array.from(this.lengths.get(first) || []);
+            if (!lengths.some(candidateLength => Math.abs(candidateLength - length) <= limit)) {
+                return word;
+            }
+
+            const grams = trigrams(chars);
+            const needed = grams.size - 4 * limit;
+            const shared = new Map();
+            grams.forEach(gram => {
+                (this.index.get(first + gram) || []).forEach(candidate => {
+                    shared.set(candidate, (shared.get(candidate) || 0) + 1);
+                });
+            });
+
+            let best = null;
+            shared.forEach((count, candidate) => {
+                const candidateChars = Array.from(candidate);
+                if (count < needed || Math.abs(candidateChars.length - length) > limit) {
+                    return;
+                }
+                const distance = osaDistance(chars, candidateChars, limit);
+                if (distance > limit || 1 - distance / Math.max(length, candidateChars.length) < this.minSimilarity) {
+                    return;
+                }
+                if (best === null || distance < best.distance || (distance === best.distance && candidate < best.word)) {
+                    best = { distance, word: candidate };
+                }
+            });
+            return best ? best.word : word;
+        }
+    }
+
+    class LocalDiagnosticEngine {
+        constructor(knowledgeBase) {
+            this.version = knowledgeBase.version;
+            // Exports from before the server reported its scoring mode only ever used the fixed weights
+            this.scoringMode = knowledgeBase.scoring_mode || 'rules';
+            this.weights = knowledgeBase.weights;
+            this.symptomIndex = new Map(knowledgeBase.symptoms.map((code, bit) => [code, bit]));
+            this.conditions = knowledgeBase.conditions.map(condition => ({
+                ...condition,
+                primarySet: new Set(condition.primary),
+                secondarySet: new Set(condition.secondary),
+                severitySet: new Set(condition.severity),
+                allSet: new Set([...condition.primary, ...condition.secondary, ...condition.severity]),
+            }));
+
+            // Word-level trie of every phrase; the codes ending at a node are kept under its codes key
+            this.trie = new Map();
+            for (const [words, code] of knowledgeBase.phrases) {
+                let node = this.trie;
+                for (const word of words) {
+                    if (!node.has(word)) {
+                        node.set(word, new Map());
+                    }
+                    node = node.get(word);
+                }
+                if (!node.codes) {
+                    node.codes = new Set();
+                }
+                node.codes.add(code);
+            }
+
+            // Present when the server corrects misspelled words too
+            this.fuzzy = knowledgeBase.fuzzy
+                ? new FuzzyMatcher(new Set(knowledgeBase.phrases.flatMap(([words]) => words)), knowledgeBase.fuzzy)
+                : null;
+        }
+
+        normalizeSymptoms(text) {
+            if (!text) {
+                return [];
+            }
+            let words = tokenize(text);
+            if (this.fuzzy) {
+                words = words.map(word => this.fuzzy.correct(word));
+            }
+            const normalized = new Set();
+            for (let start = 0; start < words.length; start++) {
+                let node = this.trie;
+                for (let i = start; i < words.length; i++) {
+                    node = node.get(words[i]);
+                    if (!node) {
+                        break;
+                    }
+                    if (node.codes) {
+                        node.codes.forEach(code => normalized.add(code));
+                    }
+                }
+            }
+            return Array.from(normalized);
+        }
+
+        diagnose(selectedSymptoms, textSymptoms = '') {
+            const allSymptoms = Array.from(new Set([...selectedSymptoms, ...this.normalizeSymptoms(textSymptoms)]));
+            if (allSymptoms.length === 0) {
+                return {
+                    diagnoses: [],
+                    message: 'No symptoms provided. Please select symptoms or describe how you feel.',
+                    total_symptoms: 0,
+                };
+            }
+
+            const userBits = new Set();
+            allSymptoms.forEach(code => {
+                if (this.symptomIndex.has(code)) {
+                    userBits.add(this.symptomIndex.get(code));
+                }
+            });
+
+            // Stable sort keeps catalog order for ties, like the engine's heapq.nlargest
+            const ranked = this.conditions
+                .map(condition => ({ condition, scored: this.score(userBits, allSymptoms, condition) }))
+                .filter(({ scored }) => scored.confidence > 0)
+                .sort((a, b) => b.scored.confidence - a.scored.confidence)
+                .slice(0, 3)
+                .map(({ scored }) => scored);
+
+            return {
+                diagnoses: ranked,
+                message: this.summaryMessage(ranked),
+                total_symptoms: allSymptoms.length,
+                processed_symptoms: allSymptoms,
+            };
+        }
+
+        score(userBits, userSymptoms, condition) {
+            const [primaryWeight, secondaryWeight, severityWeight] = this.weights;
+            let primaryMatches = 0;
+            let secondaryMatches = 0;
+            let severityMatches = 0;
+            userBits.forEach(bit => {
+                if (condition.primarySet.has(bit)) primaryMatches++;
+                if (condition.secondarySet.has(bit)) secondaryMatches++;
+                if (condition.severitySet.has(bit)) severityMatches++;
+            });
+
+            const totalScore = primaryMatches * primaryWeight + secondaryMatches * secondaryWeight +
+                severityMatches * severityWeight;
+            const confidence = condition.max_possible > 0 ? (totalScore / condition.max_possible) * 100 : 0;
+
+            let urgency = 'low';
+            if (severityMatches > 0) {
+                urgency = 'urgent';
+            } else if (condition.urgency === 'high' && primaryMatches >= 2) {
+                urgency = 'high';
+            } else if (primaryMatches >= 1) {
+                urgency = condition.urgency;
+            }
+
+            return {
+                condition: condition.name,
+                description: condition.description,
+                confidence: round1(confidence),
+                primary_matches: primaryMatches,
+                secondary_matches: secondaryMatches,
+                severity_matches: severityMatches,
+                recommendations: condition.recommendations,
+                urgency: urgency,
+                matched_symptoms: userSymptoms.filter(code =>
+                    this.symptomIndex.has(code) && condition.allSet.has(this.symptomIndex.get(code))),
+            };
+        }
+
+        summaryMessage(topConditions) {
+            if (topConditions.length === 0) {
+                return 'Based on your symptoms, we cannot match them to common conditions in our database. Please consult a healthcare professional for proper evaluation.';
+            }
+            const top = topConditions[0];
+            if (top.confidence > 70) {
+                return `Your symptoms strongly suggest ${top.condition}. Please seek medical attention for proper diagnosis and treatment.`;
+            }
+            if (top.confidence > 40) {
+                return `Your symptoms may indicate ${top.condition} or similar conditions. Medical evaluation is recommended.`;
+            }
+            return 'Your symptoms match several possible conditions. A healthcare professional can provide proper diagnosis.';
+        }
+    }
+
+    if (typeof module !== 'undefined' && module.exports) {
+        module.exports = { LocalDiagnosticEngine, tokenize };
+    } else {
+        root.LocalDiagnosticEngine = LocalDiagnosticEngine;
+    }
+})(typeof window !== 'undefined' ? window : this);
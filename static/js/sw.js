@@ -0,0 +1,48 @@
+// Automated Diagnostic System - Service worker
+//
+// Keeps the assessment page, its scripts and the knowledge base export
+// available offline. Requests go to the network first; the cached copy is
+// only used when that fails, so online visitors always get fresh pages.
+
+const CACHE_NAME = 'ads-offline-v1';
+const OFFLINE_URLS = [
+    '/',
+    '/static/js/app.js',
+    '/static/js/diagnosis.js',
+    '/static/css/custom.css',
+    '/api/knowledge-base',
+];
+
+self.addEventListener('install', (event) => {
+    event.waitUntil(caches.open(CACHE_NAME).then(cache => cache.addAll(OFFLINE_URLS)));
+    self.skipWaiting();
+});
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil(caches.keys().then(names => Promise.all(
+        names.filter(name => name !== CACHE_NAME).map(name => caches.delete(name))
+    )));
+    self.clients.claim();
+});
+
+self.addEventListener('fetch', (event) => {
+    const request = event.request;
+    const url = new URL(request.url);
+    // Pages with personal data (history, feedback) are never cached; third-party styles and scripts are
+    const cacheable = request.method === 'GET' &&
+        (url.origin !== self.location.origin || OFFLINE_URLS.includes(url.pathname));
+    if (!cacheable) {
+        return;
+    }
+    event.respondWith(
+        fetch(request)
+            .then((response) => {
+                if (response.ok || response.type === 'opaque') {
+                    const copy = response.clone();
+                    caches.open(CACHE_NAME).then(cache => cache.put(request, copy));
+                }
+                return response;
+            })
+            .catch(() => caches.match(request))
+    );
+});
@@ -0,0 +1,156 @@
+"""
+Outbreak surveillance over hourly diagnosis counts
+Each worker keeps a sliding window of submissions per (location, top
+condition, hour) in memory, counts its own diagnoses as they happen and
+periodically syncs recent hours from the hourly rollup table, which every
+worker writes. Hotspots are locations whose count for a condition in the
+latest window is far above that location's own recent baseline.
+"""
+
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select
+
+from analytics import NO_DIAGNOSIS, UNKNOWN
+from app import db
+from models import HourlyConditionStat
+
+_EPOCH = datetime(1970, 1, 1)
+
+# Hours re-read from the database on each sync; rows committed late by other workers land here
+SYNC_OVERLAP_HOURS = 2
+
+
+def hour_number(moment: datetime) -> int:
+    """Hours since the epoch of a naive UTC datetime"""
+    return int((moment - _EPOCH).total_seconds() // 3600)
+
+
+class SurveillanceWindow:
+    """Sliding-window hourly counters with a z-score detector.
+
+    The latest window_hours are compared against the baseline_windows
+    windows of the same length before them. The z-score's spread is floored
+    at the Poisson standard deviation, so a quiet location with a flat
+    baseline doesn't alarm on a couple of cases. Nothing is flagged until
+    counts go back to the start of the baseline: before the first recorded
+    hour a baseline would only be zeros, and every endemic condition would
+    look like an outbreak.
+    """
+
+    def __init__(self, window_hours: int = 24, baseline_windows: int = 14, refresh_interval: float = 60.0):
+        self.window_hours = window_hours
+        self.baseline_windows = baseline_windows
+        self.retention_hours = window_hours * (baseline_windows + 1)
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        # (location, condition) -> {hour number: submissions}
+        self._series: Dict[Tuple[str, str], Dict[int, int]] = {}
+        self._synced_hour: Optional[int] = None
+        self._oldest_hour: Optional[int] = None
+        # Earliest hour with any count, in the rollup table or observed here
+        self._first_hour: Optional[int] = None
+        self._next_refresh = 0.0
+
+    def observe(self, location: Optional[str], condition: str, created_at: Optional[datetime] = None):
+        """Count one diagnosis made by this worker, ahead of the next sync"""
+        hour = hour_number(created_at or datetime.utcnow())
+        key = (location or UNKNOWN, condition)
+        with self._lock:
+            hours = self._series.get(key)
+            if hours is None:
+                hours = self._series[key] = {}
+            hours[hour] = hours.get(hour, 0) + 1
+            if self._first_hour is None or hour < self._first_hour:
+                self._first_hour = hour
+
+    def refresh_if_due(self) -> bool:
+        if time.monotonic() < self._next_refresh:
+            return False
+        self._next_refresh = time.monotonic() + self.refresh_interval
+        self.refresh()
+        return True
+
+    def refresh(self, now: Optional[datetime] = None):
+        """Replace recent hours with the rollup table's counts and drop hours past retention"""
+        now_hour = hour_number(now or datetime.utcnow())
+        oldest = now_hour - self.retention_hours + 1
+        since = oldest if self._synced_hour is None else max(oldest, self._synced_hour - SYNC_OVERLAP_HOURS)
+
+        loaded: Dict[Tuple[str, str], Dict[int, int]] = {}
+        rows = db.session.execute(
+            select(HourlyConditionStat.location, HourlyConditionStat.condition,
+                   HourlyConditionStat.hour, HourlyConditionStat.submissions)
+            .where(HourlyConditionStat.hour >= _EPOCH + timedelta(hours=since))
+        )
+        for location, condition, hour, submissions in rows:
+            loaded.setdefault((location, condition), {})[hour_number(hour)] = submissions
+        first = db.session.scalar(select(func.min(HourlyConditionStat.hour)))
+
+        # Only the re-read hours and those that just left the window need clearing
+        stale = list(range(since, now_hour + 1))
+        if self._oldest_hour is not None:
+            stale.extend(range(max(self._oldest_hour, oldest - self.retention_hours), min(oldest, since)))
+        with self._lock:
+            for key, hours in list(self._series.items()):
+                for hour in stale:
+                    hours.pop(hour, None)
+                if not hours and key not in loaded:
+                    del self._series[key]
+            for key, hours in loaded.items():
+                self._series.setdefault(key, {}).update(hours)
+            self._synced_hour = now_hour
+            self._oldest_hour = oldest
+            if first is not None and (self._first_hour is None or hour_number(first) < self._first_hour):
+                self._first_hour = hour_number(first)
+
+    def has_baseline(self, now: Optional[datetime] = None) -> bool:
+        """Whether recorded counts cover every baseline window, so hotspots can be flagged"""
+        now_hour = hour_number(now or datetime.utcnow())
+        return self._first_hour is not None and self._first_hour <= now_hour - self.retention_hours + 1
+
+    def hotspots(self, now: Optional[datetime] = None, threshold: float = 3.0, min_count: int = 5,
+                 condition: Optional[str] = None, location: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Series whose latest window is at least threshold standard deviations above baseline"""
+        now_hour = hour_number(now or datetime.utcnow())
+        window = self.window_hours
+        results = []
+        if not self.has_baseline(now):
+            return results
+        with self._lock:
+            for (series_location, series_condition), hours in self._series.items():
+                if series_location == UNKNOWN or series_condition == NO_DIAGNOSIS:
+                    continue
+                if (condition and series_condition != condition) or (location and series_location != location):
+                    continue
+                # Window 0 is the latest window_hours, 1..baseline_windows the ones before it
+                sums = [0] * (self.baseline_windows + 1)
+                for hour, count in hours.items():
+                    age = now_hour - hour
+                    if 0 <= age < self.retention_hours:
+                        sums[age // window] += count
+                current = sums[0]
+                if current < min_count:
+                    continue
+                baseline = sums[1:]
+                mean = sum(baseline) / len(baseline)
+                std = math.sqrt(sum((c - mean) ** 2 for c in baseline) / len(baseline))
+                z_score = (current - mean) / max(std, math.sqrt(max(mean, 1.0)))
+                if z_score >= threshold:
+                    results.append({
+                        "location": series_location,
+                        "condition": series_condition,
+                        "current": current,
+                        "baseline_mean": round(mean, 2),
+                        "baseline_std": round(std, 2),
+                        "z_score": round(z_score, 2),
+                    })
+        results.sort(key=lambda r: r["z_score"], reverse=True)
+        return results
+
+    def series_count(self) -> int:
+        return len(self._series)